@@ -0,0 +1,268 @@
+import numpy as np
+import pandas as pd
+
+# 汇总维度: 客诉按 月份 × 机型 × 问题分类 × 告警代码, 出货按 月份 × 机型
+COMPLAINT_DIMENSIONS = ['月份', '机型_标准化', '问题分类', '告警代码']
+SHIPMENT_DIMENSIONS = ['月份', '机型_标准化']
+
+# 维度值缺失时的占位值 (分组键不能为空)
+MISSING_DIMENSION_VALUES = {'月份': '未知', '机型_标准化': '未知', '问题分类': '未分类', '告警代码': '无'}
+
+
+class AnalysisCube:
+    """客诉/出货计数的预汇总立方体
+
+    处理数据时按维度汇总一次, 之后任意月份/机型/分类/告警代码的过滤组合都只在汇总结果上计算。
+    计数可加减: add_*/remove_*按新增或删除的行增量更新, set_*整体重建
+    """
+
+    def __init__(self):
+        self.complaint_counts = self._empty(COMPLAINT_DIMENSIONS)
+        self.shipment_counts = self._empty(SHIPMENT_DIMENSIONS)
+
+    @staticmethod
+    def _empty(dimensions):
+        return pd.Series(
+            [], dtype='int64', name='计数',
+            index=pd.MultiIndex.from_arrays([[] for _ in dimensions], names=dimensions)
+        )
+
+    @staticmethod
+    def aggregate(df, dimensions, date_column, weights=None):
+        """按维度汇总行数 (weights为每行的计数权重, 默认为1)"""
+        keys = {}
+        for col in dimensions:
+            if col == '月份':
+                source = df[date_column] if date_column in df.columns else pd.Series(pd.NaT, index=df.index)
+                values = pd.to_datetime(source, errors='coerce').dt.to_period('M').astype(str)
+                values = values.where(source.notna() & (values != 'NaT'))
+            elif col in df.columns:
+                values = df[col].astype(object)
+            else:
+                values = pd.Series(None, index=df.index, dtype=object)
+            keys[col] = values.fillna(MISSING_DIMENSION_VALUES[col]).astype(str).to_numpy()
+
+        counts = pd.Series(1 if weights is None else weights, index=df.index, dtype='int64')
+        return counts.groupby([keys[col] for col in dimensions]).sum().rename_axis(dimensions).rename('计数')
+
+    @staticmethod
+    def _combine(counts, delta, sign):
+        combined = counts.add(delta * sign, fill_value=0).astype('int64')
+        return combined[combined != 0]
+
+    # 客诉计数
+    def set_complaints(self, df):
+        self.complaint_counts = self._empty(COMPLAINT_DIMENSIONS)
+        self.add_complaints(df)
+
+    def add_complaints(self, df, weights=None, sign=1):
+        if df is None or df.empty:
+            return
+        delta = self.aggregate(df, COMPLAINT_DIMENSIONS, '客诉时间', weights)
+        self.complaint_counts = self._combine(self.complaint_counts, delta, sign)
+
+    def remove_complaints(self, df, weights=None):
+        self.add_complaints(df, weights, sign=-1)
+
+    # 出货计数
+    def set_shipments(self, df):
+        self.shipment_counts = self._empty(SHIPMENT_DIMENSIONS)
+        self.add_shipments(df)
+
+    def add_shipments(self, df, weights=None, sign=1):
+        if df is None or df.empty:
+            return
+        delta = self.aggregate(df, SHIPMENT_DIMENSIONS, '出货时间', weights)
+        self.shipment_counts = self._combine(self.shipment_counts, delta, sign)
+
+    def remove_shipments(self, df, weights=None):
+        self.add_shipments(df, weights, sign=-1)
+
+    def load_counts(self, complaint_counts=None, shipment_counts=None):
+        """由已汇总的计数表 (如数据库汇总视图的结果) 替换客诉或出货计数, 缺少的维度按占位值处理"""
+        for dimensions, counts, count_column, attr in (
+            (COMPLAINT_DIMENSIONS, complaint_counts, '客诉数', 'complaint_counts'),
+            (SHIPMENT_DIMENSIONS, shipment_counts, '出货数', 'shipment_counts'),
+        ):
+            if counts is None:
+                continue
+            if counts.empty:
+                setattr(self, attr, self._empty(dimensions))
+                continue
+            keys = [
+                counts[col].astype(object).fillna(MISSING_DIMENSION_VALUES[col]).astype(str).to_numpy()
+                if col in counts.columns else [MISSING_DIMENSION_VALUES[col]] * len(counts)
+                for col in dimensions
+            ]
+            series = counts[count_column].astype('int64').groupby(keys).sum()
+            setattr(self, attr, series.rename_axis(dimensions).rename('计数'))
+
+    @classmethod
+    def from_counts(cls, complaint_counts, shipment_counts):
+        cube = cls()
+        cube.load_counts(complaint_counts, shipment_counts)
+        return cube
+
+    def is_empty(self):
+        return self.complaint_counts.empty
+
+    def months(self):
+        """有客诉的月份 (升序, 不含未知月份)"""
+        months = self.complaint_counts.index.unique('月份')
+        return sorted(month for month in months if month != MISSING_DIMENSION_VALUES['月份'])
+
+    def machine_types(self):
+        return sorted(self.complaint_counts.index.unique('机型_标准化'))
+
+    @staticmethod
+    def _filter(counts, **filters):
+        """按维度过滤; 过滤值为None时不过滤该维度"""
+        mask = pd.Series(True, index=counts.index)
+        for col, values in filters.items():
+            if values is not None:
+                mask &= counts.index.get_level_values(col).isin(list(values))
+        return counts[mask.to_numpy()]
+
+    def complaints(self, months=None, machine_types=None, categories=None, alarm_codes=None, by=None):
+        """过滤后的客诉数, 按by列出的维度汇总 (默认不分组, 返回总数)"""
+        counts = self._filter(self.complaint_counts, 月份=months, 机型_标准化=machine_types,
+                              问题分类=categories, 告警代码=alarm_codes)
+        if not by:
+            return int(counts.sum())
+        return counts.groupby(level=by).sum()
+
+    def shipments(self, months=None, machine_types=None, by=None):
+        """过滤后的出货数, 按by列出的维度汇总 (默认不分组, 返回总数)"""
+        counts = self._filter(self.shipment_counts, 月份=months, 机型_标准化=machine_types)
+        if not by:
+            return int(counts.sum())
+        return counts.groupby(level=by).sum()
+
+
+class CohortCube:
+    """生产批次(按SN推算的生产月份 × 机型)的现场失效统计
+
+    客诉按 生产月份 × 机型 × 服役月数(客诉月份 - 生产月份) 计数, 在役数量按 生产月份 × 机型 计数。
+    两者都可加减, 与AnalysisCube一样支持增量更新
+    """
+
+    def __init__(self):
+        self.failure_counts = AnalysisCube._empty(['生产月份', '机型_标准化', '服役月数'])
+        self.population_counts = AnalysisCube._empty(['生产月份', '机型_标准化'])
+
+    @staticmethod
+    def _month_ordinals(values):
+        """转为月序号 (相邻月份相差1), 无法识别的为NaN"""
+        if isinstance(values.dtype, pd.PeriodDtype):
+            periods = values
+        else:
+            periods = pd.to_datetime(values, errors='coerce').dt.to_period('M')
+        ordinals = pd.Series(periods.array.asi8, index=values.index, dtype='float64')
+        return ordinals.where(periods.notna())
+
+    @staticmethod
+    def _machine_types(df):
+        if '机型_标准化' in df.columns:
+            return df['机型_标准化'].astype(object).fillna('未知').astype(str)
+        return pd.Series('未知', index=df.index)
+
+    @staticmethod
+    def _ordinal_to_month(ordinals):
+        """月序号转为YYYY-MM (序号0为1970-01); 按不重复的序号格式化"""
+        unique, inverse = np.unique(ordinals, return_inverse=True)
+        labels = np.array([f'{ordinal // 12 + 1970:04d}-{ordinal % 12 + 1:02d}' for ordinal in unique], dtype=object)
+        return labels[inverse.reshape(-1)]
+
+    def add_complaints(self, df, weights=None, sign=1):
+        """按客诉行增量更新失效计数; 需要 生产日期 和 客诉时间 列, 无法推算服役月数的行不计入"""
+        if df is None or df.empty or '生产日期' not in df.columns or '客诉时间' not in df.columns:
+            return
+        production = self._month_ordinals(df['生产日期'])
+        service_months = self._month_ordinals(df['客诉时间']) - production
+        valid = (service_months >= 0).to_numpy()
+        if not valid.any():
+            return
+
+        counts = pd.Series(1 if weights is None else weights, index=df.index, dtype='int64')[valid]
+        keys = [
+            self._ordinal_to_month(production[valid].astype('int64').to_numpy()),
+            self._machine_types(df)[valid].to_numpy(),
+            service_months[valid].astype('int64').to_numpy(),
+        ]
+        delta = counts.groupby(keys).sum().rename_axis(['生产月份', '机型_标准化', '服役月数'])
+        self.failure_counts = AnalysisCube._combine(self.failure_counts, delta, sign)
+
+    def remove_complaints(self, df, weights=None):
+        self.add_complaints(df, weights, sign=-1)
+
+    def set_complaints(self, df):
+        self.failure_counts = AnalysisCube._empty(['生产月份', '机型_标准化', '服役月数'])
+        self.add_complaints(df)
+
+    def add_population(self, df, sign=1):
+        """按在役设备(如带SN的出货记录)增量更新各批次的数量; 需要 生产日期 列"""
+        if df is None or df.empty or '生产日期' not in df.columns:
+            return
+        production = self._month_ordinals(df['生产日期'])
+        valid = production.notna().to_numpy()
+        if not valid.any():
+            return
+
+        counts = pd.Series(1, index=df.index, dtype='int64')[valid]
+        keys = [
+            self._ordinal_to_month(production[valid].astype('int64').to_numpy()),
+            self._machine_types(df)[valid].to_numpy(),
+        ]
+        delta = counts.groupby(keys).sum().rename_axis(['生产月份', '机型_标准化'])
+        self.population_counts = AnalysisCube._combine(self.population_counts, delta, sign)
+
+    def set_population(self, df):
+        self.population_counts = AnalysisCube._empty(['生产月份', '机型_标准化'])
+        self.add_population(df)
+
+    def is_empty(self):
+        return self.failure_counts.empty
+
+    def failure_matrix(self, machine_types=None, max_months_in_service=None, by_machine=True, as_of=None):
+        """累计失效率矩阵(%): 行为生产批次, 列为服役月数
+        
+        单元格为该批次服役满N个月时的累计失效数 / 批次数量; 截至as_of (默认为最近的客诉月份)
+        批次尚未服役满N个月的单元格为空。by_machine为False时各机型合并为一个批次
+        """
+        failures = self.failure_counts
+        population = self.population_counts
+        if machine_types is not None:
+            failures = failures[failures.index.get_level_values('机型_标准化').isin(list(machine_types))]
+            population = population[population.index.get_level_values('机型_标准化').isin(list(machine_types))]
+        if failures.empty:
+            return pd.DataFrame()
+
+        cohort_levels = ['生产月份', '机型_标准化'] if by_machine else ['生产月份']
+        failures = failures.groupby(level=cohort_levels + ['服役月数']).sum()
+        population = population.groupby(level=cohort_levels).sum()
+
+        max_service = int(failures.index.get_level_values('服役月数').max())
+        if max_months_in_service is not None:
+            max_service = min(max_service, max_months_in_service)
+        matrix = failures.unstack('服役月数', fill_value=0).reindex(columns=range(max_service + 1), fill_value=0)
+        cumulative = matrix.cumsum(axis=1)
+
+        cohort_population = population.reindex(cumulative.index)
+        rates = cumulative.div(cohort_population.where(cohort_population > 0), axis=0) * 100
+
+        # 截至观察月份, 批次已服役的月数之后的单元格尚无观测
+        production_ordinals = pd.PeriodIndex(cumulative.index.get_level_values('生产月份'), freq='M').asi8
+        if as_of is None:
+            # 最近的客诉月份 = 生产月份 + 服役月数 的最大值
+            all_keys = self.failure_counts.index
+            as_of_ordinal = int((
+                pd.PeriodIndex(all_keys.get_level_values('生产月份'), freq='M').asi8
+                + all_keys.get_level_values('服役月数').to_numpy()
+            ).max())
+        else:
+            as_of_ordinal = pd.Period(as_of, 'M').ordinal
+        cohort_age = as_of_ordinal - production_ordinals
+        unobserved = np.arange(max_service + 1)[None, :] > cohort_age[:, None]
+        rates = rates.mask(unobserved)
+        rates.columns.name = '服役月数'
+        return rates
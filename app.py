@@ -5,11 +5,17 @@ from datetime import datetime, timedelta
 import plotly.express as px
 import plotly.graph_objects as go
 import io
+import hashlib
+import os
 import base64
+import tempfile
+import time
 
 # 导入自定义模块
-from data_processing import ComplaintDataProcessor
+from analysis_cube import AnalysisCube
+from data_processing import ComplaintDataProcessor, DEFECT_RATE_WINDOWS
 from database import ComplaintDatabase
+from file_reader import analysis_columns, read_data_file
 from report_generator import ReportGenerator
 
 # 页面配置
@@ -20,15 +26,135 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# 本地持久化的SN索引目录 (各会话共享): 默认在当前用户目录下, 不使用共享的临时目录
+SN_INDEX_DIR = os.environ.get(
+    'CCDC_SN_INDEX_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'ccdc', 'sn_index')
+)
+
+# 增量处理缓存目录: 默认在当前用户目录下 (不使用共享的临时目录), 每个客诉文件一个子目录
+INCREMENTAL_CACHE_DIR = os.environ.get(
+    'CCDC_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'ccdc', 'incremental')
+)
+
+# 流式处理结果目录: 每个会话只保留最近一次的结果, 超过保留时间的结果文件在下次流式处理时删除
+STREAM_OUTPUT_DIR = os.environ.get(
+    'CCDC_OUTPUT_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'ccdc', 'streaming')
+)
+STREAM_OUTPUT_TTL = 24 * 3600
+# 不超过该大小(MB)的结果才提供浏览器下载 (下载按钮需要把文件整体读入内存)
+STREAM_DOWNLOAD_MAX_MB = 200
+
+# Supabase未配置时使用的本地数据库文件
+LOCAL_DB_PATH = os.environ.get('CCDC_LOCAL_DB', os.path.join(tempfile.gettempdir(), 'ccdc_local.db'))
+
+@st.cache_resource
+def get_shared_database():
+    """进程内所有会话共享的数据库客户端及其查询结果缓存"""
+    return ComplaintDatabase(local_db_path=LOCAL_DB_PATH)
+
+def incremental_cache_dir(file_name):
+    """客诉文件对应的增量缓存目录 (按文件名区分数据集, 累计更新的同名文件复用同一缓存)"""
+    dataset_key = hashlib.sha256(str(file_name).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(INCREMENTAL_CACHE_DIR, dataset_key)
+
+def new_stream_output_path():
+    """分配本次流式处理的结果文件路径, 并删除本会话上次的结果和过期的结果"""
+    os.makedirs(STREAM_OUTPUT_DIR, mode=0o700, exist_ok=True)
+    previous_path = st.session_state.pop('stream_output_path', None)
+    now = time.time()
+    for file_name in os.listdir(STREAM_OUTPUT_DIR):
+        path = os.path.join(STREAM_OUTPUT_DIR, file_name)
+        try:
+            if path == previous_path or now - os.path.getmtime(path) > STREAM_OUTPUT_TTL:
+                os.remove(path)
+        except OSError:
+            pass
+    
+    output_path = os.path.join(
+        STREAM_OUTPUT_DIR,
+        f"processed_complaints_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.urandom(4).hex()}.parquet"
+    )
+    st.session_state.stream_output_path = output_path
+    return output_path
+
 # 初始化Session State
 if 'processor' not in st.session_state:
     st.session_state.processor = ComplaintDataProcessor()
+    # 已有持久化的SN索引时直接以内存映射方式打开
+    st.session_state.processor.open_sn_index(SN_INDEX_DIR)
 if 'db' not in st.session_state:
-    st.session_state.db = ComplaintDatabase()
+    st.session_state.db = get_shared_database()
 if 'report_gen' not in st.session_state:
     st.session_state.report_gen = ReportGenerator()
 if 'current_data' not in st.session_state:
     st.session_state.current_data = {}
+if 'classification_rules' not in st.session_state:
+    st.session_state.classification_rules = {
+        '硬件故障': ['损坏', '故障', '不工作', '无响应', '短路', '断路', '烧坏'],
+        '软件问题': ['程序', '软件', '固件', '升级', '版本', 'bug', '死机', '卡顿'],
+        '安装问题': ['安装', '接线', '连接', '配置', '设置', '调试'],
+        '性能问题': ['效率低', '功率不足', '过热', '噪音', '振动', '不稳定'],
+        '外观问题': ['划伤', '变形', '颜色', '外观', '掉漆', '破损'],
+        '其他': []
+    }
+
+# 解析后的上传文件最多缓存的个数 (按最近使用淘汰), 以及缓存保留时间 (秒);
+# 缓存为进程内各会话共享, 大文件的解析结果不会在会话结束后长期占用内存
+UPLOAD_CACHE_ENTRIES = 8
+UPLOAD_CACHE_TTL = 3600
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL, show_spinner="解析文件中...")
+def parse_uploaded_file(content_hash, file_name, kind, _file_bytes):
+    """按文件内容哈希缓存解析结果, 各会话共享; 同一文件重复上传或页面刷新时直接返回"""
+    return read_data_file(io.BytesIO(_file_bytes), file_name, kind)
+
+def read_uploaded_file(uploaded_file, kind):
+    """按文件类型 (complaints/shipments/sn_database_a/sn_database_b) 读取上传的Excel/CSV文件"""
+    file_bytes = uploaded_file.getvalue()
+    content_hash = hashlib.sha1(file_bytes).hexdigest()
+    return parse_uploaded_file(content_hash, uploaded_file.name, kind, file_bytes)
+
+def make_upload_progress():
+    """创建上传进度条, 返回供数据库分批上传调用的进度回调"""
+    progress_bar = st.progress(0.0, text="上传进度")
+    
+    def update(uploaded_rows, total_rows):
+        progress_bar.progress(uploaded_rows / total_rows if total_rows else 1.0,
+                              text=f"已上传 {uploaded_rows}/{total_rows} 行")
+    
+    return update
+
+def collect_sn_upload():
+    """后台SN上传完成后取出结果并记录操作日志 (任意页面的下一次运行都会检查)"""
+    upload_job = st.session_state.get('sn_upload_job')
+    if upload_job is None or not upload_job.done():
+        return
+    
+    del st.session_state['sn_upload_job']
+    success, message = upload_job.result()
+    st.session_state.sn_upload_result = (success, message)
+    if success:
+        if 'operation_log' not in st.session_state:
+            st.session_state.operation_log = []
+        st.session_state.operation_log.append({
+            '时间': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            '操作': '上传SN数据库',
+            '记录数': st.session_state.pop('sn_upload_records', 0)
+        })
+
+@st.fragment(run_every=1.0)
+def show_sn_upload_progress():
+    """每秒刷新后台SN上传的进度, 不阻塞页面; 上传结束后重新运行整个页面以显示结果"""
+    upload_job = st.session_state.get('sn_upload_job')
+    if upload_job is None:
+        return
+    for table_name, (uploaded_rows, total_rows) in sorted(upload_job.snapshot().items()):
+        st.progress(uploaded_rows / total_rows if total_rows else 1.0,
+                    text=f"{table_name}: 已上传 {uploaded_rows}/{total_rows} 行")
+    if upload_job.done():
+        st.rerun()
+
+collect_sn_upload()
 
 # 标题和说明
 st.title("📊 AI驱动的客诉数据分析系统")
@@ -102,13 +228,52 @@ elif page == "数据上传":
             type=['xlsx', 'xls', 'csv'],
             key="complaint_upload"
         )
+        stream_mode = st.checkbox(
+            "大文件流式处理", value=False,
+            help="分块读取并完成清洗、SN补充和分类，结果增量写入Parquet文件，内存占用不随文件大小增长"
+        )
         
-        if uploaded_file is not None:
+        if uploaded_file is not None and stream_mode:
+            if st.button("开始流式处理", type="primary"):
+                with st.spinner("流式处理数据中..."):
+                    try:
+                        output_path = new_stream_output_path()
+                        total_rows = st.session_state.processor.process_complaints_streaming(
+                            uploaded_file, output_path,
+                            classification_rules=st.session_state.classification_rules
+                        )
+                        st.success(f"流式处理完成: 共写入 {total_rows} 行")
+                        st.dataframe(pd.DataFrame(st.session_state.processor.pipeline_stats),
+                                   use_container_width=True)
+                        
+                        # 结果保留在服务器上, 可按路径直接读取; 较小的结果同时提供下载
+                        output_mb = os.path.getsize(output_path) / 1024 ** 2
+                        st.markdown(f"结果文件 ({output_mb:.1f} MB，保留 {STREAM_OUTPUT_TTL // 3600} 小时):")
+                        st.code(output_path, language=None)
+                        if output_mb <= STREAM_DOWNLOAD_MAX_MB:
+                            with open(output_path, "rb") as file:
+                                st.download_button(
+                                    label="下载Parquet结果",
+                                    data=file,
+                                    file_name=os.path.basename(output_path),
+                                    mime="application/octet-stream"
+                                )
+                        else:
+                            st.info(f"结果超过 {STREAM_DOWNLOAD_MAX_MB} MB，请按上面的路径在服务器上读取")
+                        
+                        if 'operation_log' not in st.session_state:
+                            st.session_state.operation_log = []
+                        st.session_state.operation_log.append({
+                            '时间': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                            '操作': '流式处理客诉数据',
+                            '记录数': total_rows
+                        })
+                    except Exception as e:
+                        st.error(f"流式处理时出错: {str(e)}")
+        
+        elif uploaded_file is not None:
             try:
-                if uploaded_file.name.endswith('.csv'):
-                    df = pd.read_csv(uploaded_file)
-                else:
-                    df = pd.read_excel(uploaded_file)
+                df = read_uploaded_file(uploaded_file, 'complaints')
                 
                 st.success(f"成功读取数据: {len(df)} 行 × {len(df.columns)} 列")
                 
@@ -125,11 +290,14 @@ elif page == "数据上传":
                 
                 # 保存到Session State
                 st.session_state.current_data['raw_complaints'] = df
+                st.session_state.current_data['raw_complaints_name'] = uploaded_file.name
                 
                 # 上传到数据库按钮
                 if st.button("上传到数据库", type="primary"):
                     with st.spinner("上传数据中..."):
-                        success, message = st.session_state.db.upload_complaint_data(df)
+                        success, message = st.session_state.db.upload_complaint_data(
+                            df, progress_callback=make_upload_progress()
+                        )
                         if success:
                             st.success(message)
                             # 记录操作
@@ -158,24 +326,27 @@ elif page == "数据上传":
         
         if uploaded_file is not None:
             try:
-                if uploaded_file.name.endswith('.csv'):
-                    df = pd.read_csv(uploaded_file)
-                else:
-                    df = pd.read_excel(uploaded_file)
+                df = read_uploaded_file(uploaded_file, 'shipments')
                 
                 st.success(f"成功读取数据: {len(df)} 行 × {len(df.columns)} 列")
                 
                 with st.expander("数据预览"):
                     st.dataframe(df.head(10), use_container_width=True)
                 
-                # 保存到Session State
-                st.session_state.current_data['raw_shipments'] = df
+                # 保存到Session State (分析只需部分列; 上传数据库时使用完整数据)
+                analysis_df = analysis_columns(df, 'shipments')
+                st.session_state.current_data['raw_shipments'] = analysis_df
                 
                 if st.button("上传出货数据到数据库", type="primary"):
                     with st.spinner("上传数据中..."):
-                        success, message = st.session_state.db.upload_shipment_data(df)
+                        success, message = st.session_state.db.upload_shipment_data(
+                            df, progress_callback=make_upload_progress()
+                        )
                         if success:
                             st.success(message)
+                            # 出货文件为累计数据, 按本次文件重建出货计数
+                            st.session_state.processor.analysis_cube.set_shipments(analysis_df)
+                            st.session_state.processor.update_cohort_population(analysis_df)
                             if 'operation_log' not in st.session_state:
                                 st.session_state.operation_log = []
                             st.session_state.operation_log.append({
@@ -205,10 +376,7 @@ elif page == "数据上传":
             
             if uploaded_file_a is not None:
                 try:
-                    if uploaded_file_a.name.endswith('.csv'):
-                        df_a = pd.read_csv(uploaded_file_a)
-                    else:
-                        df_a = pd.read_excel(uploaded_file_a)
+                    df_a = read_uploaded_file(uploaded_file_a, 'sn_database_a')
                     
                     st.info(f"数据库A: {len(df_a)} 条记录")
                     st.session_state.current_data['sn_database_a'] = df_a
@@ -225,10 +393,7 @@ elif page == "数据上传":
             
             if uploaded_file_b is not None:
                 try:
-                    if uploaded_file_b.name.endswith('.csv'):
-                        df_b = pd.read_csv(uploaded_file_b)
-                    else:
-                        df_b = pd.read_excel(uploaded_file_b)
+                    df_b = read_uploaded_file(uploaded_file_b, 'sn_database_b')
                     
                     st.info(f"数据库B: {len(df_b)} 条记录")
                     st.session_state.current_data['sn_database_b'] = df_b
@@ -242,24 +407,25 @@ elif page == "数据上传":
             df_a = st.session_state.current_data.get('sn_database_a')
             df_b = st.session_state.current_data.get('sn_database_b')
             
-            if st.button("上传SN数据库", type="primary"):
-                with st.spinner("上传数据中..."):
-                    success, message = st.session_state.db.upload_sn_database(df_a, df_b)
-                    if success:
-                        st.success(message)
-                        # 加载到处理器
-                        st.session_state.processor.load_sn_databases(df_a, df_b)
-                        
-                        if 'operation_log' not in st.session_state:
-                            st.session_state.operation_log = []
-                        total_records = (len(df_a) if df_a is not None else 0) + (len(df_b) if df_b is not None else 0)
-                        st.session_state.operation_log.append({
-                            '时间': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                            '操作': '上传SN数据库',
-                            '记录数': total_records
-                        })
-                    else:
-                        st.error(f"上传失败: {message}")
+            uploading = 'sn_upload_job' in st.session_state
+            if st.button("上传SN数据库", type="primary", disabled=uploading):
+                # 两张表在后台并发上传, 任务保存在会话中, 页面刷新或切换后仍可查看进度和结果
+                st.session_state.pop('sn_upload_result', None)
+                st.session_state.sn_upload_job = st.session_state.db.start_sn_upload(df_a, df_b)
+                st.session_state.sn_upload_records = (
+                    (len(df_a) if df_a is not None else 0) + (len(df_b) if df_b is not None else 0)
+                )
+                with st.spinner("上传过程中建立SN索引..."):
+                    st.session_state.processor.load_sn_databases(df_a, df_b, index_dir=SN_INDEX_DIR)
+            
+            if 'sn_upload_job' in st.session_state:
+                show_sn_upload_progress()
+            elif 'sn_upload_result' in st.session_state:
+                success, message = st.session_state.sn_upload_result
+                if success:
+                    st.success(message)
+                else:
+                    st.error(f"上传失败: {message}")
 
 # 数据处理页面
 elif page == "数据处理":
@@ -283,49 +449,70 @@ elif page == "数据处理":
     with col1:
         clean_data = st.checkbox("数据清洗与增强", value=True, 
                                 help="执行SN解析、机型纠错、信息补全等")
+        explode_sn = st.checkbox("多SN拆分为多行", value=False,
+                                help="一条客诉包含多个SN时，每个SN单独成行并通过客诉ID关联")
+        incremental = st.checkbox("增量处理", value=False,
+                                 help="只处理与上次相比新增或变化的行，其余行复用缓存结果")
     
     with col2:
         classify_data = st.checkbox("自动分类", value=True,
                                    help="根据规则自动分类客诉问题")
+        measure_memory = st.checkbox("统计各阶段内存峰值", value=False,
+                                     help="用tracemalloc统计每个处理阶段的峰值分配内存，处理会明显变慢")
     
     with col3:
         enrich_with_sn = st.checkbox("SN信息补充", value=True,
                                     help="使用SN数据库补充设备信息")
+        n_workers = st.number_input("并行进程数", min_value=1, max_value=os.cpu_count() or 1, value=1,
+                                   help="大于1时按行切分数据，在多个进程中并行处理")
     
     # 开始处理按钮
     if st.button("开始数据处理", type="primary"):
         with st.spinner("处理数据中..."):
-            # 第一步：数据清洗
-            if clean_data:
-                processed_df = st.session_state.processor.clean_complaint_data(raw_df)
-                st.session_state.current_data['cleaned_complaints'] = processed_df
-                
-                with st.expander("数据清洗结果"):
-                    st.dataframe(processed_df.head(), use_container_width=True)
-                    st.metric("处理后列数", len(processed_df.columns))
-            
-            # 第二步：数据分类
-            if classify_data:
-                if 'cleaned_complaints' in st.session_state.current_data:
-                    input_df = st.session_state.current_data['cleaned_complaints']
-                else:
-                    input_df = raw_df
-                
-                classified_df = st.session_state.processor.classify_complaints(input_df)
-                st.session_state.current_data['classified_complaints'] = classified_df
-                
+            # 清洗 → SN补充 → 分类 在同一数据表上依次完成, 只保留最终结果
+            st.session_state.current_data.pop('processed_complaints', None)
+            processing_options = dict(
+                clean=clean_data,
+                enrich_sn=enrich_with_sn,
+                classify=classify_data,
+                explode_sn=explode_sn,
+                classification_rules=st.session_state.classification_rules,
+                measure_memory=measure_memory
+            )
+            if incremental:
+                processed_df = st.session_state.processor.process_complaints_incremental(
+                    raw_df,
+                    n_workers=int(n_workers),
+                    cache_dir=incremental_cache_dir(st.session_state.current_data.get('raw_complaints_name')),
+                    **processing_options
+                )
+                stats = st.session_state.processor.incremental_stats
+                st.info(f"增量处理: 共 {stats['总行数']} 行，复用缓存 {stats['缓存命中行数']} 行，"
+                        f"新处理 {stats['新处理行数']} 行")
+            else:
+                processed_df = st.session_state.processor.process_complaints_parallel(
+                    raw_df, n_workers=int(n_workers), **processing_options
+                )
+                # 增量处理时预汇总计数已按变化的行更新, 全量处理时整体重建
+                st.session_state.processor.update_analysis_cube(processed_df)
+            st.session_state.current_data['processed_complaints'] = processed_df
+            
+            with st.expander("处理阶段统计"):
+                st.dataframe(pd.DataFrame(st.session_state.processor.pipeline_stats), use_container_width=True)
+                st.metric("处理后列数", len(processed_df.columns))
+            
+            if '问题分类' in processed_df.columns:
                 with st.expander("数据分类结果"):
-                    if '问题分类' in classified_df.columns:
-                        st.dataframe(classified_df[['SN', '问题描述', '问题分类', '告警代码']].head(), 
-                                   use_container_width=True)
-                        
-                        # 显示分类分布
-                        if not classified_df.empty:
-                            class_dist = classified_df['问题分类'].value_counts()
-                            fig = px.pie(values=class_dist.values, 
-                                       names=class_dist.index,
-                                       title="问题分类分布")
-                            st.plotly_chart(fig, use_container_width=True)
+                    st.dataframe(processed_df[['SN', '问题描述', '问题分类', '告警代码']].head(), 
+                               use_container_width=True)
+                    
+                    # 显示分类分布
+                    if not processed_df.empty:
+                        class_dist = processed_df['问题分类'].value_counts()
+                        fig = px.pie(values=class_dist.values, 
+                                   names=class_dist.index,
+                                   title="问题分类分布")
+                        st.plotly_chart(fig, use_container_width=True)
             
             st.success("数据处理完成!")
             
@@ -339,10 +526,10 @@ elif page == "数据处理":
             })
     
     # 显示当前处理后的数据
-    if 'classified_complaints' in st.session_state.current_data:
+    if 'processed_complaints' in st.session_state.current_data:
         st.subheader("最终处理结果")
         
-        final_df = st.session_state.current_data['classified_complaints']
+        final_df = st.session_state.current_data['processed_complaints']
         
         # 数据摘要
         col1, col2, col3, col4 = st.columns(4)
@@ -365,6 +552,13 @@ elif page == "数据处理":
         
         with tab1:
             st.dataframe(final_df, use_container_width=True)
+            
+            # 按原始行号查看清洗前的原始数据
+            raw_store = st.session_state.processor.raw_store
+            if '原始行号' in final_df.columns and raw_store is not None and len(raw_store) > 0:
+                with st.expander("查看原始数据"):
+                    row_id = st.number_input("原始行号", min_value=0, max_value=len(raw_store) - 1, step=1)
+                    st.dataframe(st.session_state.processor.get_raw_rows([row_id]).T, use_container_width=True)
         
         with tab2:
             columns_info = []
@@ -403,15 +597,20 @@ elif page == "数据处理":
 elif page == "统计分析":
     st.header("统计分析")
     
-    # 获取数据
-    complaint_data = st.session_state.db.get_complaint_data()
-    shipment_data = st.session_state.db.get_shipment_data()
+    # 预汇总计数: 优先使用本会话处理结果的立方体, 否则由数据库汇总视图建立
+    cube = st.session_state.processor.analysis_cube
+    if cube.is_empty():
+        cube = AnalysisCube.from_counts(
+            st.session_state.db.get_complaint_counts(), st.session_state.db.get_shipment_counts()
+        )
+    elif cube.shipment_counts.empty:
+        cube.load_counts(shipment_counts=st.session_state.db.get_shipment_counts())
     
-    if complaint_data.empty:
+    if cube.is_empty():
         st.warning("暂无客诉数据，请先上传并处理数据")
         st.stop()
     
-    if shipment_data.empty:
+    if cube.shipment_counts.empty:
         st.warning("暂无出货数据，请先上传出货数据")
         st.stop()
     
@@ -421,50 +620,56 @@ elif page == "统计分析":
     
     with col1:
         # 月份选择
-        if '客诉时间' in complaint_data.columns:
-            complaint_data['客诉时间'] = pd.to_datetime(complaint_data['客诉时间'], errors='coerce')
-            available_months = complaint_data['客诉时间'].dt.to_period('M').unique()
-            month_options = [str(m) for m in available_months] + ['全部月份']
-        else:
-            month_options = ['全部月份']
-        
+        month_options = cube.months() + ['全部月份']
         selected_month = st.selectbox("选择月份", month_options, index=len(month_options)-1)
     
     with col2:
         # 机型选择
-        if '机型_标准化' in complaint_data.columns:
-            machine_types = complaint_data['机型_标准化'].unique().tolist()
-            machine_options = ['全部机型'] + [str(m) for m in machine_types if pd.notna(m)]
-        else:
-            machine_options = ['全部机型']
-        
+        machine_options = ['全部机型'] + cube.machine_types()
         selected_machines = st.multiselect("选择机型", machine_options, default=['全部机型'])
     
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        trend_window = st.selectbox("趋势滚动窗口(月)", list(DEFECT_RATE_WINDOWS), index=1)
+    
+    with col2:
+        shipment_lag = st.number_input("出货滞后月数", min_value=0, max_value=24, value=0,
+                                       help="客诉与N个月前的出货对齐计算不良率")
+    
     # 分析按钮
     if st.button("开始统计分析", type="primary"):
         with st.spinner("分析数据中..."):
-            # 过滤数据
-            analysis_complaints = complaint_data.copy()
-            analysis_shipments = shipment_data.copy()
+            single_machine = (selected_machines[0] if len(selected_machines) == 1 and selected_machines[0] != '全部机型'
+                              else None)
             
-            if selected_month != '全部月份' and '客诉时间' in analysis_complaints.columns:
+            # 集中性问题的具体案例只获取需要的列
+            if selected_month != '全部月份':
                 target_month = pd.Period(selected_month)
+                month_range = (target_month.start_time.date().isoformat(), target_month.end_time.date().isoformat())
+            else:
+                month_range = (None, None)
+            analysis_complaints = st.session_state.current_data.get('processed_complaints')
+            if analysis_complaints is None:
+                analysis_complaints = st.session_state.db.get_complaint_data(
+                    *month_range, machine_type=single_machine,
+                    columns=['SN', '问题描述', '客诉时间', '机型_标准化', '问题分类']
+                )
+            
+            if selected_month != '全部月份' and '客诉时间' in analysis_complaints.columns:
                 analysis_complaints = analysis_complaints[
-                    analysis_complaints['客诉时间'].dt.to_period('M') == target_month
+                    pd.to_datetime(analysis_complaints['客诉时间'], errors='coerce').dt.to_period('M') == target_month
                 ]
             
             if '全部机型' not in selected_machines and '机型_标准化' in analysis_complaints.columns:
                 analysis_complaints = analysis_complaints[
                     analysis_complaints['机型_标准化'].isin(selected_machines)
                 ]
-                analysis_shipments = analysis_shipments[
-                    analysis_shipments['机型_标准化'].isin(selected_machines)
-                ]
             
             # 1. 计算不良率
             st.subheader("不良率统计")
             defect_stats = st.session_state.processor.calculate_defect_rate(
-                analysis_complaints, analysis_shipments, selected_month, selected_machines
+                None, None, selected_month, selected_machines, cube=cube
             )
             
             if not defect_stats.empty:
@@ -490,11 +695,22 @@ elif page == "统计分析":
                     st.metric("最高不良率", f"{max_rate:.2f}%")
                     st.metric("最低不良率", f"{min_rate:.2f}%")
             
+            # 不良率趋势 (全部历史月份一次计算)
+            st.subheader("不良率趋势")
+            defect_trend = st.session_state.processor.calculate_defect_rate_trend(
+                cube, windows=(trend_window,), shipment_lag=int(shipment_lag), machine_types=selected_machines
+            )
+            if not defect_trend.empty:
+                fig = px.line(defect_trend, x='月份', y='不良率(%)', color='机型_标准化', markers=True,
+                              title=f'{trend_window}个月滚动不良率 (出货滞后{int(shipment_lag)}个月)')
+                st.plotly_chart(fig, use_container_width=True)
+            else:
+                st.info(f"数据不足 {trend_window} 个月，无法计算 {trend_window} 个月滚动不良率")
+            
             # 2. 集中性问题分析
             st.subheader("集中性问题分析")
             issue_stats, concentrated_issues, case_details = st.session_state.processor.analyze_concentrated_issues(
-                analysis_complaints, selected_month, 
-                selected_machines[0] if len(selected_machines) == 1 and selected_machines[0] != '全部机型' else None
+                analysis_complaints, selected_month, selected_machines, cube=cube
             )
             
             if not issue_stats.empty:
@@ -528,8 +744,24 @@ elif page == "统计分析":
                                 st.write("**具体案例**:")
                                 st.dataframe(case_details[issue], use_container_width=True)
             
+            # 3. 生产批次失效分析
+            st.subheader("生产批次失效分析")
+            cohort_rates = st.session_state.processor.calculate_cohort_failure_rates(selected_machines)
+            if cohort_rates.empty or cohort_rates.isna().all().all():
+                st.info("暂无可用于批次分析的数据 (需要处理后的客诉数据及带SN的出货数据)")
+            else:
+                cohort_labels = [' / '.join(map(str, label)) for label in cohort_rates.index]
+                fig = px.imshow(cohort_rates.to_numpy(), x=[str(col) for col in cohort_rates.columns], y=cohort_labels,
+                                labels=dict(x='服役月数', y='生产批次', color='累计失效率(%)'),
+                                color_continuous_scale='RdYlGn_r', aspect='auto',
+                                title='各生产批次累计失效率')
+                st.plotly_chart(fig, use_container_width=True)
+                with st.expander("批次失效率明细"):
+                    st.dataframe(cohort_rates.round(2), use_container_width=True)
+            
             # 保存分析结果
             st.session_state.current_data['defect_stats'] = defect_stats
+            st.session_state.current_data['defect_trend'] = defect_trend
             st.session_state.current_data['issue_analysis'] = issue_stats
             st.session_state.current_data['concentrated_issues'] = concentrated_issues
             
@@ -539,7 +771,7 @@ elif page == "统计分析":
             st.session_state.operation_log.append({
                 '时间': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                 '操作': f'统计分析 ({selected_month})',
-                '记录数': len(analysis_complaints)
+                '记录数': cube.complaints(months=None if selected_month == '全部月份' else [selected_month])
             })
             
             st.success("统计分析完成!")
@@ -597,7 +829,8 @@ elif page == "报告生成":
             )
             
             # 生成可视化图表
-            figures = st.session_state.report_gen.create_visualizations(defect_stats, issue_analysis)
+            defect_trend = st.session_state.current_data.get('defect_trend')
+            figures = st.session_state.report_gen.create_visualizations(defect_stats, issue_analysis, defect_trend)
             
             # 显示报告预览
             st.subheader("报告预览")
@@ -693,24 +926,36 @@ elif page == "系统设置":
         
         st.info("设置客诉问题的分类规则。")
         
-        # 默认分类规则
-        default_rules = {
-            '硬件故障': ['损坏', '故障', '不工作', '无响应', '短路', '断路', '烧坏'],
-            '软件问题': ['程序', '软件', '固件', '升级', '版本', 'bug', '死机', '卡顿'],
-            '安装问题': ['安装', '接线', '连接', '配置', '设置', '调试'],
-            '性能问题': ['效率低', '功率不足', '过热', '噪音', '振动', '不稳定'],
-            '外观问题': ['划伤', '变形', '颜色', '外观', '掉漆', '破损'],
-            '其他': []
-        }
+        # 当前分类规则 (会话内生效, 数据处理时使用)
+        classification_rules = st.session_state.classification_rules
+        
+        def apply_rule_change():
+            """规则修改后对已处理数据做增量重新分类"""
+            processed_df = st.session_state.current_data.get('processed_complaints')
+            if processed_df is None or '问题分类' not in processed_df.columns:
+                return
+            
+            reclassified_df = st.session_state.processor.reclassify_complaints(processed_df, classification_rules)
+            st.session_state.current_data['processed_complaints'] = reclassified_df
+            
+            # 预汇总计数只更新分类变化的行
+            changed = (processed_df['问题分类'].astype(object) != reclassified_df['问题分类'].astype(object)).to_numpy()
+            cube = st.session_state.processor.analysis_cube
+            cube.remove_complaints(processed_df[changed])
+            cube.add_complaints(reclassified_df[changed])
+            stats = st.session_state.processor.reclassify_stats
+            mode = "全量重新分类" if stats['全量重算'] else "增量重新分类"
+            st.info(f"{mode}: 共 {stats['总行数']} 行，重新判定 {stats['重新判定行数']} 行 "
+                    f"(规则版本 {stats['规则版本']})")
         
         # 编辑分类规则
         st.write("### 当前分类规则")
         
-        categories = list(default_rules.keys())
+        categories = list(classification_rules.keys())
         selected_category = st.selectbox("选择分类", categories)
         
         if selected_category:
-            current_keywords = default_rules[selected_category]
+            current_keywords = classification_rules[selected_category]
             new_keywords = st.text_area(
                 f"{selected_category} 关键词",
                 value="\n".join(current_keywords),
@@ -719,8 +964,9 @@ elif page == "系统设置":
             
             if st.button("更新规则"):
                 updated_keywords = [k.strip() for k in new_keywords.split('\n') if k.strip()]
-                default_rules[selected_category] = updated_keywords
+                classification_rules[selected_category] = updated_keywords
                 st.success(f"已更新 {selected_category} 的分类规则")
+                apply_rule_change()
         
         # 添加新分类
         st.write("### 添加新分类")
@@ -733,8 +979,9 @@ elif page == "系统设置":
         
         if st.button("添加分类") and new_category:
             keywords = [k.strip() for k in new_category_keywords.split(',') if k.strip()]
-            default_rules[new_category] = keywords
+            classification_rules[new_category] = keywords
             st.success(f"已添加分类: {new_category}")
+            apply_rule_change()
     
     with tab3:
         st.subheader("用户管理")
@@ -1,130 +1,844 @@
 import pandas as pd
 import numpy as np
+import copy
+import hashlib
+import json
+import multiprocessing
+import os
 import re
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+from importlib.util import find_spec
 import streamlit as st
+from analysis_cube import AnalysisCube, CohortCube
+from file_reader import iter_xlsx_chunks
+from sn_index import MemorySNIndex, PersistentSNIndex
+
+try:
+    import ahocorasick
+except ImportError:  # 未安装时分类匹配按优先级逐个关键词查找
+    ahocorasick = None
+
+# 批量子串查找使用的文本列类型: 有pyarrow时为Arrow字符串列, 查找在C++中完成
+TEXT_DTYPE = 'string[pyarrow]' if find_spec('pyarrow') is not None else object
+
+# SN数据库A、B的索引名称 (持久化时的文件名)
+SN_INDEX_NAMES = ('sn_database_a', 'sn_database_b')
+
+# 多个SN之间的分隔符: 逗号、分号、空白、中文逗号、顿号
+SN_SEPARATORS = r'[,;\s，、]+'
+SN_SEPARATOR_EDGES = r'^[,;\s，、]+|[,;\s，、]+$'
+
+# 机型标准化规则 (按优先级排列): 先匹配关键词, 再匹配产品代码
+MACHINE_TYPE_KEYWORDS = [
+    ('微逆', '微逆'),
+    ('组串单相', '单相组串'),
+    ('组串三相', '三相组串'),
+    ('储能单相', '单相储能'),
+    ('储能三相低压', '低压三相储能'),
+    ('储能三相高压', '高压三相储能'),
+    ('裂相', '裂相储能'),
+    ('离网机', '单相储能'),
+    ('pcs', '工商业储能'),
+    ('mppt', '工商业储能'),
+    ('sts', '工商业储能'),
+    ('微储', '阳台储能'),
+    ('阳台', '阳台储能'),
+]
+
+MACHINE_TYPE_PRODUCT_CODES = [
+    ('LP1', '单相储能'),
+    ('LP2', '裂相储能'),
+    ('LP3', '低压三相储能'),
+    ('HP3', '高压三相储能'),
+    ('MG', '微逆'),
+    ('OG', '单相储能'),
+    ('P1', '单相组串'),
+    ('P3', '三相组串'),
+]
+
+MACHINE_TYPE_CATEGORIES = list(dict.fromkeys(
+    [std_type for _, std_type in MACHINE_TYPE_KEYWORDS + MACHINE_TYPE_PRODUCT_CODES] + ['其他', '未知']
+))
+
+
+def _compile_rules(rules):
+    """将有序规则编译为单个正则
+    
+    使用前瞻匹配以找出所有(含重叠的)命中位置, 同一位置按规则顺序取第一个
+    """
+    alternation = '|'.join(re.escape(keyword) for keyword, _ in rules)
+    priorities = {keyword: i for i, (keyword, _) in enumerate(rules)}
+    return re.compile(f'(?=({alternation}))'), priorities
+
+
+_KEYWORD_PATTERN, _KEYWORD_PRIORITY = _compile_rules(MACHINE_TYPE_KEYWORDS)
+_PRODUCT_CODE_PATTERN, _PRODUCT_CODE_PRIORITY = _compile_rules(MACHINE_TYPE_PRODUCT_CODES)
+
+
+@lru_cache(maxsize=4096)
+def _match_machine_type(desc):
+    """按规则优先级返回机型描述对应的标准机型"""
+    for text, pattern, priorities, rules in (
+        (desc.lower(), _KEYWORD_PATTERN, _KEYWORD_PRIORITY, MACHINE_TYPE_KEYWORDS),
+        (desc.upper(), _PRODUCT_CODE_PATTERN, _PRODUCT_CODE_PRIORITY, MACHINE_TYPE_PRODUCT_CODES),
+    ):
+        hits = pattern.findall(text)
+        if hits:
+            return rules[min(priorities[hit] for hit in hits)][1]
+    
+    return "其他"
+
+# 告警代码模式 (按优先级排列): 每个分支都从文本开头起查找, 先尝试的分支优先
+ALARM_CODE_PATTERN = re.compile(
+    r'^(?:'
+    r'.*?(ERR\d{2,4})'          # ERR001, ERR1234
+    r'|.*?(ALM\d{2,4})'         # ALM001
+    r'|.*?(F\d{2,4})'           # F001, F123
+    r'|.*?(E\d{2,4})'           # E001
+    r'|.*?代码[：:]\s*(\w+)'    # 代码: ERR001
+    r'|.*?报警[：:]\s*(\w+)'    # 报警: ERR001
+    r')',
+    re.IGNORECASE | re.DOTALL
+)
+
+# 不良率趋势默认计算的滚动窗口 (月)
+DEFECT_RATE_WINDOWS = (1, 3, 6, 12)
+
+# 默认分类规则 (按优先级排列, 先命中的分类优先)
+DEFAULT_CLASSIFICATION_RULES = {
+    '硬件故障': ['损坏', '故障', '不工作', '无响应', '短路', '断路'],
+    '软件问题': ['程序', '软件', '固件', '升级', '版本', 'bug'],
+    '安装问题': ['安装', '接线', '连接', '配置', '设置'],
+    '性能问题': ['效率低', '功率不足', '过热', '噪音'],
+    '外观问题': ['划伤', '变形', '颜色', '外观'],
+    '其他': []  # 默认分类
+}
+
+# 界面上表示不按月份/机型过滤的选项
+ALL_MONTHS = '全部月份'
+ALL_MACHINE_TYPES = ('全部', '全部机型')
+
+
+def _expand_by_codes(codes, unique_results, na_result=None):
+    """按pd.factorize的编码将各唯一值上的结果映射回各行, 空值 (编码-1) 对应na_result
+    
+    unique_results为ExtensionArray (如PeriodArray) 时保留其类型, 空值为该类型的缺失值
+    """
+    if isinstance(unique_results, pd.api.extensions.ExtensionArray):
+        return pd.api.extensions.take(unique_results, codes, allow_fill=True, fill_value=na_result)
+    if not isinstance(unique_results, np.ndarray):
+        unique_results = np.array(unique_results, dtype=object)
+    # 末尾追加空值对应的结果, 使编码-1直接映射到它
+    return np.append(unique_results, np.array([na_result], dtype=unique_results.dtype))[codes]
+
+
+def _normalize_filters(month=None, machine_types=None):
+    """将界面选择的月份和机型 (单个机型或机型列表) 转为过滤条件
+    
+    返回(月份列表, 机型列表), 未选择或选择"全部"时对应项为None (不过滤)
+    """
+    months = None if month in (None, ALL_MONTHS) else [str(month)]
+    machine_types = [machine_types] if isinstance(machine_types, str) else list(machine_types or [])
+    if not machine_types or any(option in machine_types for option in ALL_MACHINE_TYPES):
+        machine_types = None
+    return months, machine_types
+
+
+
+class ClassificationMatcher:
+    """由分类规则编译得到的关键词匹配器
+    
+    关键词按(分类顺序, 关键词顺序)排定优先级, 取优先级最高的命中关键词, 与逐个分类、逐个关键词检查的结果一致。
+    安装了pyahocorasick时所有关键词编入一个Aho-Corasick自动机, 每条文本只扫描一次, 与关键词数量无关;
+    否则按优先级逐个关键词在尚未命中的文本中查找
+    """
+    
+    def __init__(self, classification_rules):
+        self.keyword_category = {}
+        for category, keywords in classification_rules.items():
+            for keyword in keywords:
+                if keyword:
+                    self.keyword_category.setdefault(keyword.lower(), category)
+        
+        self.keywords = list(self.keyword_category)
+        # 规则版本: 由编译后的(关键词, 分类)有序列表决定, 规则内容不变则版本不变
+        self.version = hashlib.sha1(repr(list(self.keyword_category.items())).encode('utf-8')).hexdigest()[:12]
+        self.automaton = None
+        if ahocorasick is not None and self.keywords:
+            self.automaton = ahocorasick.Automaton()
+            for priority, keyword in enumerate(self.keywords):
+                self.automaton.add_word(keyword, priority)
+            self.automaton.make_automaton()
+    
+    def diff(self, old_matcher):
+        """与旧规则比较, 返回(新增关键词, 删除关键词)
+        
+        保留下来的关键词相对顺序或所属分类有变化时返回None, 此时无法判断哪些行会受影响
+        """
+        kept_old = [(keyword, category) for keyword, category in old_matcher.keyword_category.items()
+                    if keyword in self.keyword_category]
+        kept_new = [(keyword, category) for keyword, category in self.keyword_category.items()
+                    if keyword in old_matcher.keyword_category]
+        if kept_old != kept_new:
+            return None
+        
+        added = [keyword for keyword in self.keyword_category if keyword not in old_matcher.keyword_category]
+        removed = [keyword for keyword in old_matcher.keyword_category if keyword not in self.keyword_category]
+        return added, removed
+    
+    def match_keyword(self, text):
+        """返回文本(已小写)中优先级最高的命中关键词, 未命中返回None"""
+        if self.automaton is not None:
+            priority = min((priority for _, priority in self.automaton.iter(text)), default=None)
+            return None if priority is None else self.keywords[priority]
+        return next((keyword for keyword in self.keywords if keyword in text), None)
+    
+    def match_keywords(self, texts):
+        """批量匹配不含空值的文本数组(已小写), 返回各文本命中的关键词列表"""
+        if self.automaton is not None or not self.keywords:
+            return [self.match_keyword(text) for text in texts]
+        
+        # 无自动机时按优先级逐个关键词查找, 已命中的文本不再参与后续关键词的查找
+        matched = np.full(len(texts), None, dtype=object)
+        remaining = pd.Series(texts, dtype=TEXT_DTYPE)
+        for keyword in self.keywords:
+            if remaining.empty:
+                break
+            hit = remaining.str.contains(keyword, regex=False).to_numpy(dtype=bool)
+            matched[remaining.index[hit]] = keyword
+            remaining = remaining[~hit]
+        return list(matched)
+    
+    def match(self, texts):
+        """按唯一文本批量匹配, 返回(分类, 命中关键词)两列, 未命中的分类为其他"""
+        codes, uniques = pd.factorize(texts.str.lower())
+        keywords = self.match_keywords(np.asarray(uniques, dtype=object))
+        categories = [self.keyword_category.get(keyword, '其他') for keyword in keywords]
+        
+        categories = _expand_by_codes(codes, categories, '其他')
+        keywords = _expand_by_codes(codes, keywords)
+        return (
+            pd.Series(categories, index=texts.index),
+            pd.Series(keywords, index=texts.index, dtype=object)
+        )
+
+
+def _process_rss_mb():
+    """当前进程的常驻内存(MB), 由/proc/self/statm读取 (开销很小); 平台不支持时返回None"""
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(resident_pages * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2, 1)
+
+
+# 并行处理时工作进程内的处理器, 由进程池初始化函数设置
+_WORKER_PROCESSOR = None
+
+
+def _init_partition_worker(processor):
+    """进程池初始化: 保存共享的处理器 (含SN索引)"""
+    global _WORKER_PROCESSOR
+    _WORKER_PROCESSOR = processor
+
+
+def _process_partition(partition, options):
+    """在工作进程中处理一个分区, 返回处理结果和各阶段统计"""
+    processed = _WORKER_PROCESSOR.process_complaints(partition, **options)
+    return processed, _WORKER_PROCESSOR.pipeline_stats
+
+
+class RawRowStore:
+    """原始数据存储
+    
+    只保存对上传时原始数据表的引用, 处理后的数据只携带原始行号, 查看时再按行号取出原始行
+    """
+    
+    def __init__(self, raw_df):
+        self.raw_df = raw_df
+    
+    def __len__(self):
+        return len(self.raw_df)
+    
+    def get_rows(self, row_ids):
+        """按原始行号取出原始行"""
+        return self.raw_df.iloc[np.asarray(row_ids, dtype=int)]
+
+
+class IncrementalCacheStore:
+    """增量处理缓存的本地存储: 处理结果按Parquet分段保存, 上下文键和分段清单保存为JSON
+    
+    每次只追加写入新处理的行, 不重写全部历史; 磁盘上的行数超过仍在使用的行数的两倍时合并为一个分段。
+    不使用pickle, 读取缓存不会执行其中的代码; 目录创建为仅当前用户可访问
+    """
+    
+    MANIFEST_NAME = 'manifest.json'
+    
+    def __init__(self, directory):
+        self.directory = directory
+    
+    @staticmethod
+    def serialize_key(context_key):
+        return json.dumps(context_key, ensure_ascii=False, default=str)
+    
+    def _read_manifest(self):
+        manifest_path = os.path.join(self.directory, self.MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+    
+    def _write_manifest(self, manifest):
+        manifest_path = os.path.join(self.directory, self.MANIFEST_NAME)
+        tmp_path = f'{manifest_path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file, ensure_ascii=False)
+        os.replace(tmp_path, manifest_path)
+    
+    def _write_segment(self, rows):
+        segment = f'rows-{uuid.uuid4().hex}.parquet'
+        rows.to_parquet(os.path.join(self.directory, segment), index=False)
+        return segment
+    
+    def _remove_segments(self, segments):
+        for segment in segments:
+            try:
+                os.remove(os.path.join(self.directory, segment))
+            except OSError:
+                pass
+    
+    def load(self, context_key):
+        """读取与上下文键一致的缓存行, 不存在或不一致时返回None"""
+        manifest = self._read_manifest()
+        if manifest is None or manifest['context_key'] != self.serialize_key(context_key):
+            return None
+        if not manifest['segments']:
+            return None
+        rows = pd.concat(
+            [pd.read_parquet(os.path.join(self.directory, segment)) for segment in manifest['segments']],
+            ignore_index=True
+        )
+        # Parquet中的混合类型文本列读回时恢复为object, 与新处理的行一致
+        for col in manifest['object_columns']:
+            if col in rows.columns:
+                rows[col] = rows[col].astype(object)
+        return rows
+    
+    def save(self, context_key, rows, new_rows):
+        """保存缓存: rows为当前全部缓存行, new_rows为本次新处理的行 (已包含在rows中)"""
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        key = self.serialize_key(context_key)
+        manifest = self._read_manifest()
+        
+        stale_segments = []
+        if manifest is None or manifest['context_key'] != key or manifest['rows'] > 2 * len(rows):
+            # 上下文变化或已删除的行过多: 只保留当前缓存行
+            if manifest is not None:
+                stale_segments = manifest['segments']
+            segments = [self._write_segment(rows)] if rows is not None and not rows.empty else []
+            stored_rows = len(rows) if segments else 0
+        else:
+            segments = list(manifest['segments'])
+            stored_rows = manifest['rows']
+            if new_rows is not None and not new_rows.empty:
+                segments.append(self._write_segment(new_rows))
+                stored_rows += len(new_rows)
+        
+        object_columns = [] if rows is None else [col for col in rows.columns if rows[col].dtype == object]
+        self._write_manifest({
+            'context_key': key, 'segments': segments, 'rows': stored_rows, 'object_columns': object_columns,
+        })
+        self._remove_segments(stale_segments)
+
 
 class ComplaintDataProcessor:
     def __init__(self):
         self.sn_database_a = None
         self.sn_database_b = None
+        self.sn_index_a = None
+        self.sn_index_b = None
+        self._classification_matchers = {}
+        self._matchers_by_version = {}
+        self.reclassify_stats = {}
+        self.raw_store = None
+        self.pipeline_stats = []
+        self.sn_version = (None, None)
+        self.incremental_cache = None
+        self.incremental_stats = {}
+        # 处理结果的预汇总计数, 统计分析直接在其上过滤
+        self.analysis_cube = AnalysisCube()
+        self.cohort_cube = CohortCube()
+        self._cube_row_hashes = None
+        
+    def load_sn_databases(self, df_a, df_b=None, index_dir=None):
+        """加载SN数据库并建立SN索引
         
-    def load_sn_databases(self, df_a, df_b=None):
-        """加载SN数据库"""
+        index_dir不为空时将索引持久化到该目录 (内容未变化时直接复用已有索引),
+        之后的会话可通过open_sn_index以内存映射方式直接打开
+        """
         self.sn_database_a = df_a
         self.sn_database_b = df_b
+        # SN数据库的内容指纹, 数据库变化时增量处理缓存自动失效
+        self.sn_version = (self.frame_fingerprint(df_a), self.frame_fingerprint(df_b))
+        
+        indexes = []
+        for name, sn_df, fingerprint in zip(SN_INDEX_NAMES, (df_a, df_b), self.sn_version):
+            sn_index = None
+            if index_dir and fingerprint is not None:
+                sn_index = PersistentSNIndex.open(index_dir, name, fingerprint)
+            if sn_index is None:
+                sn_index = self.build_sn_index(sn_df)
+                if index_dir and sn_index is not None:
+                    sn_index = PersistentSNIndex.build(sn_index.index_df, index_dir, name, fingerprint)
+                elif index_dir:
+                    # 未提供该数据库时删除之前持久化的索引, 之后的会话不会再用旧数据补充
+                    PersistentSNIndex.remove(index_dir, name)
+            indexes.append(sn_index)
+        self.sn_index_a, self.sn_index_b = indexes
+    
+    def open_sn_index(self, index_dir):
+        """以内存映射方式打开已持久化的SN索引, 数据库A的索引不存在时返回False"""
+        sn_index_a = PersistentSNIndex.open(index_dir, SN_INDEX_NAMES[0])
+        if sn_index_a is None:
+            return False
+        
+        sn_index_b = PersistentSNIndex.open(index_dir, SN_INDEX_NAMES[1])
+        self.sn_database_a = None
+        self.sn_database_b = None
+        self.sn_index_a = sn_index_a
+        self.sn_index_b = sn_index_b
+        self.sn_version = tuple(
+            sn_index.meta['fingerprint'] if sn_index is not None else None
+            for sn_index in (sn_index_a, sn_index_b)
+        )
+        return True
+    
+    @staticmethod
+    def frame_fingerprint(df):
+        """数据表内容(含列名)的指纹, 空表返回None"""
+        if df is None:
+            return None
         
-    def clean_complaint_data(self, df):
-        """客诉数据清洗与增强 - A.1"""
-        cleaned_df = df.copy()
+        digest = hashlib.sha1(repr(list(df.columns)).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+        return digest.hexdigest()
+    
+    def get_raw_rows(self, row_ids):
+        """按原始行号读取清洗前的原始数据"""
+        if self.raw_store is None:
+            return pd.DataFrame()
+        return self.raw_store.get_rows(row_ids)
+    
+    @staticmethod
+    def normalize_sn(sn_series):
+        """SN统一转为去空格的字符串, 空值保持为空"""
+        normalized = sn_series.astype(str).str.strip()
+        return normalized.where(sn_series.notna())
+    
+    def build_sn_index(self, sn_df):
+        """以SN为键建立哈希索引 (重复SN保留第一条)"""
+        if sn_df is None or 'SN' not in sn_df.columns:
+            return None
         
-        # 记录原始列
-        if '原始数据' not in cleaned_df.columns:
-            cleaned_df['原始数据'] = cleaned_df.to_dict('records')
+        index_df = sn_df.assign(SN=self.normalize_sn(sn_df['SN']))
+        index_df = index_df[index_df['SN'].notna()].drop_duplicates('SN', keep='first')
+        return MemorySNIndex(index_df.set_index('SN'))
         
-        # 1. 处理SN列 - 多个SN的情况
+    def clean_complaint_data(self, df, explode_sn=False, enrich_sn=True, copy=True):
+        """客诉数据清洗与增强 - A.1
+        
+        explode_sn为True时, 一个单元格中的多个SN拆分为多行, 每行通过客诉ID关联原始客诉;
+        copy为False时直接在传入的数据表上添加列 (只整列替换, 不原地修改已有列)
+        """
+        cleaned_df = df.copy() if copy else df
+        
+        # 记录原始行号, 原始数据不再逐行复制, 需要时按行号从原始数据存储中读取
+        if '原始行号' not in cleaned_df.columns:
+            self.raw_store = RawRowStore(df if copy else df.copy(deep=False))
+            cleaned_df['原始行号'] = np.arange(len(cleaned_df))
+        
+        # 1. 处理SN列 - 多个SN的情况（用逗号、分号或空格分隔）
         if 'SN' in cleaned_df.columns:
             cleaned_df['SN_原始'] = cleaned_df['SN']
             
-            def process_sn_cell(cell):
-                if pd.isna(cell):
-                    return None, None
-                
-                # 检查是否包含多个SN（用逗号、分号或空格分隔）
-                cell_str = str(cell)
-                separators = [',', ';', ' ', '，', '、']
-                
-                for sep in separators:
-                    if sep in cell_str:
-                        sn_list = [s.strip() for s in cell_str.split(sep) if s.strip()]
-                        if len(sn_list) > 1:
-                            # 保留第一个SN在SN列
-                            first_sn = sn_list[0]
-                            # 所有SN放入问题描述
-                            all_sns = '; '.join(sn_list)
-                            return first_sn, all_sns
-                
-                return cell_str, None
+            sn_str = self.normalize_sn(cleaned_df['SN_原始'])
+            sn_str = sn_str.str.replace(SN_SEPARATOR_EDGES, '', regex=True)
+            # 按object拆分: 整列为空时字符串类型的拆分结果会变为浮点列, 无法再用.str访问
+            sn_lists = sn_str.astype(object).str.split(SN_SEPARATORS, regex=True)
+            has_multiple = sn_lists.str.len() > 1
             
-            cleaned_df[['SN', '多个SN列表']] = cleaned_df['SN_原始'].apply(
-                lambda x: pd.Series(process_sn_cell(x))
-            )
+            # 保留第一个SN在SN列, 所有SN放入问题描述
+            cleaned_df['SN'] = sn_lists.str[0]
+            cleaned_df['多个SN列表'] = sn_lists.str.join('; ').where(has_multiple)
             
             # 如果有多个SN，添加到问题描述
-            mask = cleaned_df['多个SN列表'].notna()
-            if '问题描述' in cleaned_df.columns and mask.any():
-                cleaned_df.loc[mask, '问题描述'] = cleaned_df.loc[mask].apply(
-                    lambda row: f"{row['问题描述']} [多个SN: {row['多个SN列表']}]" 
-                    if pd.notna(row['问题描述']) else f"[多个SN: {row['多个SN列表']}]",
-                    axis=1
-                )
+            if '问题描述' in cleaned_df.columns and has_multiple.any():
+                annotation = '[多个SN: ' + cleaned_df['多个SN列表'] + ']'
+                desc = cleaned_df['问题描述']
+                annotated_desc = (desc.astype(str) + ' ' + annotation).where(desc.notna(), annotation)
+                cleaned_df['问题描述'] = annotated_desc.where(has_multiple, desc)
+            
+            # 拆分模式: 每个SN单独一行
+            if explode_sn:
+                if '客诉ID' not in cleaned_df.columns:
+                    cleaned_df['客诉ID'] = cleaned_df['原始行号']
+                cleaned_df['SN'] = sn_lists.where(has_multiple, cleaned_df['SN'])
+                cleaned_df = cleaned_df.explode('SN', ignore_index=True)
+                cleaned_df['SN序号'] = cleaned_df.groupby('客诉ID', sort=False).cumcount() + 1
         
         # 2. 机型纠错与标准化
         if '机器型号' in cleaned_df.columns:
             cleaned_df['机型_原始'] = cleaned_df['机器型号']
-            cleaned_df['机型_标准化'] = cleaned_df['机器型号'].apply(self.standardize_machine_type)
+            cleaned_df['机型_标准化'] = self.standardize_machine_types(cleaned_df['机器型号'])
         
         # 3. 根据SN补充信息
-        if 'SN' in cleaned_df.columns and self.sn_database_a is not None:
-            cleaned_df = self.enrich_with_sn_info(cleaned_df)
+        if enrich_sn and 'SN' in cleaned_df.columns and self.sn_index_a is not None:
+            cleaned_df = self.enrich_with_sn_info(cleaned_df, copy=False)
         
         # 4. 功率标准化
         if '功率' in cleaned_df.columns:
             cleaned_df['功率_原始'] = cleaned_df['功率']
-            cleaned_df[['功率_标准化', '功率单位']] = cleaned_df['功率'].apply(
-                lambda x: pd.Series(self.standardize_power(x))
-            )
+            cleaned_df['功率_标准化'], cleaned_df['功率单位'] = self.standardize_powers(cleaned_df['功率'])
         
         # 5. 添加处理时间戳
         cleaned_df['数据处理时间'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
         return cleaned_df
     
-    def standardize_machine_type(self, machine_desc):
-        """标准化机型描述"""
-        if pd.isna(machine_desc):
-            return "未知"
+    def process_complaints(self, df, clean=True, enrich_sn=True, classify=True,
+                           explode_sn=False, classification_rules=None, measure_memory=False):
+        """客诉数据处理流水线: 清洗 → SN补充 → 分类
         
-        desc = str(machine_desc).lower()
-        
-        # 根据需求文档中的规则
-        mapping_rules = {
-            '微逆': '微逆',
-            '组串单相': '单相组串',
-            '组串三相': '三相组串',
-            '储能单相': '单相储能',
-            '储能三相低压': '低压三相储能',
-            '储能三相高压': '高压三相储能',
-            '裂相': '裂相储能',
-            '离网机': '单相储能',
-            'pcs': '工商业储能',
-            'mppt': '工商业储能',
-            'sts': '工商业储能',
-            '微储': '阳台储能',
-            '阳台': '阳台储能',
-        }
+        各阶段在同一个数据表上依次添加列, 不再逐阶段整表复制; 原始数据表保持不变。
+        每个阶段的耗时和常驻内存的变化 (阶段前后之差) 记录在self.pipeline_stats中;
+        measure_memory为True时另用tracemalloc统计各阶段的峰值分配内存 (开销较大, 仅用于排查)
+        """
+        stages = []
+        if clean:
+            stages.append(('数据清洗', lambda data: self.clean_complaint_data(
+                data, explode_sn=explode_sn, enrich_sn=enrich_sn, copy=False
+            )))
+        elif enrich_sn and 'SN' in df.columns and self.sn_index_a is not None:
+            stages.append(('SN信息补充', lambda data: self.enrich_with_sn_info(data, copy=False)))
+        if classify:
+            stages.append(('自动分类', lambda data: self.classify_complaints(
+                data, classification_rules, copy=False
+            )))
+        
+        tracing = measure_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        
+        self.pipeline_stats = []
+        try:
+            # 浅复制: 共享原始列数据, 新增或替换的列不影响原始数据表
+            processed_df = df.copy(deep=False)
+            for stage_name, stage in stages:
+                started = time.perf_counter()
+                rss_before = _process_rss_mb()
+                if measure_memory:
+                    tracemalloc.reset_peak()
+                
+                processed_df = stage(processed_df)
+                
+                stage_stats = {
+                    '阶段': stage_name,
+                    '记录数': len(processed_df),
+                    '耗时(秒)': round(time.perf_counter() - started, 3),
+                }
+                rss_after = _process_rss_mb()
+                if rss_after is not None:
+                    stage_stats['常驻内存增量(MB)'] = round(rss_after - rss_before, 1)
+                if measure_memory:
+                    stage_stats['阶段峰值分配(MB)'] = round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 1)
+                self.pipeline_stats.append(stage_stats)
+        finally:
+            if tracing:
+                tracemalloc.stop()
+        
+        return processed_df
+    
+    def process_complaints_parallel(self, df, n_workers=None, **options):
+        """多进程并行处理: 按行切分为若干分区, 在进程池中执行清洗/SN补充/分类
+        
+        SN索引通过进程池初始化参数传给各工作进程: fork方式(Linux)下子进程直接共享父进程内存
+        (写时复制), 不逐任务序列化; 其他平台上每个工作进程只序列化一次。
+        结果按分区顺序拼接, 与串行处理的行顺序一致。options与process_complaints的参数相同
+        """
+        n_workers = n_workers or os.cpu_count() or 1
+        n_partitions = min(n_workers, len(df))
+        if n_partitions <= 1:
+            return self.process_complaints(df, **options)
+        
+        # 在切分前统一分配原始行号, 保证各分区的行号全局唯一
+        partitioned_df = df.copy(deep=False)
+        if options.get('clean', True) and '原始行号' not in partitioned_df.columns:
+            self.raw_store = RawRowStore(df)
+            partitioned_df['原始行号'] = np.arange(len(partitioned_df))
+        
+        bounds = np.linspace(0, len(partitioned_df), n_partitions + 1).astype(int)
+        partitions = [partitioned_df.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+        
+        # 在父进程中编译并登记分类匹配器: 工作进程直接复用, 之后的增量重新分类也能按规则版本找到它
+        if options.get('classify', True):
+            self.get_classification_matcher(options.get('classification_rules') or DEFAULT_CLASSIFICATION_RULES)
+        
+        # 工作进程使用的处理器只共享SN索引和分类匹配器, 不携带原始数据、缓存和预汇总计数
+        worker_processor = copy.copy(self)
+        worker_processor.sn_database_a = None
+        worker_processor.sn_database_b = None
+        worker_processor.raw_store = None
+        worker_processor.incremental_cache = None
+        worker_processor.analysis_cube = None
+        worker_processor.cohort_cube = None
+        worker_processor._cube_row_hashes = None
+        worker_processor.pipeline_stats = []
+        
+        mp_context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(
+            max_workers=n_partitions,
+            mp_context=mp_context,
+            initializer=_init_partition_worker,
+            initargs=(worker_processor,)
+        ) as executor:
+            results = list(executor.map(_process_partition, partitions, [options] * n_partitions))
+        
+        processed_df = pd.concat([processed for processed, _ in results])
+        if options.get('explode_sn'):
+            processed_df = processed_df.reset_index(drop=True)
+        if '数据处理时间' in processed_df.columns:
+            processed_df['数据处理时间'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        
+        self.pipeline_stats = [
+            {'分区': partition_index, **stage_stats}
+            for partition_index, (_, partition_stats) in enumerate(results, 1)
+            for stage_stats in partition_stats
+        ]
+        return processed_df
+    
+    def process_complaints_incremental(self, df, n_workers=1, cache_dir=None, **options):
+        """增量处理: 按行内容指纹缓存处理结果, 只处理新增或变化的行
+        
+        SN数据库、分类规则、处理选项或数据列发生变化时缓存整体失效。
+        cache_dir不为空时缓存同时保存到该目录 (见IncrementalCacheStore), 供之后的会话复用。
+        options与process_complaints的参数相同, 命中统计记录在self.incremental_stats中
+        """
+        if df.empty:
+            # 没有需要处理的行: 与process_complaints一样返回空结果, 缓存保持不变
+            result = self.process_complaints(df, **options)
+            self.update_analysis_cube(result)
+            self.incremental_stats = {'总行数': 0, '缓存命中行数': 0, '新处理行数': 0}
+            return result
+        
+        source_columns = [col for col in df.columns if col != '原始行号']
+        row_hashes = pd.util.hash_pandas_object(df[source_columns], index=False).to_numpy()
+        context_key = self._incremental_context_key(source_columns, options)
+        
+        cache = self.incremental_cache
+        cache_store = IncrementalCacheStore(cache_dir) if cache_dir else None
+        if cache is None and cache_store is not None:
+            cached_rows = cache_store.load(context_key)
+            if cached_rows is not None:
+                cache = {'context_key': context_key, 'rows': cached_rows}
+        if cache is None or cache['context_key'] != context_key:
+            cache = {'context_key': context_key, 'rows': None}
+            self._cube_row_hashes = None
+        
+        # 只保留本次数据中仍存在的行的缓存
+        previous_rows = cached_rows = cache['rows']
+        if cached_rows is not None:
+            cached_rows = cached_rows[cached_rows['行指纹'].isin(row_hashes)]
+            is_new = ~np.isin(row_hashes, cached_rows['行指纹'].to_numpy())
+        else:
+            is_new = np.ones(len(df), dtype=bool)
+        
+        # 内容相同的行只处理第一条
+        new_rows = None
+        new_positions = np.flatnonzero(is_new & ~pd.Series(row_hashes).duplicated().to_numpy())
+        if len(new_positions):
+            new_df = df.iloc[new_positions].copy(deep=False)
+            new_df['原始行号'] = new_positions
+            new_rows = self.process_complaints_parallel(new_df, n_workers=n_workers, **options)
+            new_rows['行指纹'] = row_hashes[new_rows['原始行号'].to_numpy()]
+            if cached_rows is None or cached_rows.empty:
+                cached_rows = new_rows.reset_index(drop=True)
+            else:
+                cached_rows = pd.concat([cached_rows, new_rows], ignore_index=True)
         
-        for keyword, std_type in mapping_rules.items():
-            if keyword in desc:
-                return std_type
-        
-        # 检查产品代码
-        product_code_patterns = {
-            'LP1': '单相储能',
-            'LP2': '裂相储能',
-            'LP3': '低压三相储能',
-            'HP3': '高压三相储能',
-            'MG': '微逆',
-            'OG': '单相储能',
-            'P1': '单相组串',
-            'P3': '三相组串',
+        cache['rows'] = cached_rows
+        self.incremental_cache = cache
+        if cache_store is not None:
+            cache_store.save(context_key, cached_rows, new_rows)
+        
+        # 按本次数据的行顺序组装结果, 行号以本次数据为准
+        output_columns = [col for col in cached_rows.columns if col != '行指纹']
+        row_order = pd.DataFrame({'行指纹': row_hashes, '当前行号': np.arange(len(df))})
+        result = row_order.merge(cached_rows, on='行指纹', how='left', sort=False)
+        result['原始行号'] = result['当前行号']
+        if options.get('explode_sn') and '客诉ID' not in df.columns and '客诉ID' in result.columns:
+            result['客诉ID'] = result['当前行号']
+        result = result[output_columns]
+        
+        self.raw_store = RawRowStore(df)
+        self._update_cube_incremental(result, row_hashes, previous_rows, new_rows)
+        self.incremental_stats = {
+            '总行数': len(df),
+            '缓存命中行数': int((~is_new).sum()),
+            '新处理行数': len(new_positions),
         }
+        return result
+    
+    def update_analysis_cube(self, processed_df):
+        """按完整的处理结果重建预汇总计数"""
+        self.analysis_cube.set_complaints(processed_df)
+        self.cohort_cube.set_complaints(processed_df)
+        self._cube_row_hashes = None
+    
+    def _update_cube_incremental(self, result, row_hashes, previous_rows, new_rows):
+        """按行指纹的增减只更新变化部分的计数; 与上次增量处理无法衔接时整体重建"""
+        if self._cube_row_hashes is None:
+            self.analysis_cube.set_complaints(result)
+            self.cohort_cube.set_complaints(result)
+        else:
+            # 每个行指纹在本次与上次数据中出现次数的差, 即该指纹对应的处理结果行的计数增量
+            count_delta = pd.Series(row_hashes).value_counts().sub(
+                pd.Series(self._cube_row_hashes).value_counts(), fill_value=0
+            )
+            count_delta = count_delta[count_delta != 0]
+            if len(count_delta):
+                # 本次新处理的行指纹不在上次的缓存中, 两者合起来恰好覆盖所有变化的指纹
+                candidate_rows = pd.concat([previous_rows, new_rows], ignore_index=True)
+                delta_rows = candidate_rows[candidate_rows['行指纹'].isin(count_delta.index)]
+                weights = delta_rows['行指纹'].map(count_delta).astype('int64').to_numpy()
+                self.analysis_cube.add_complaints(delta_rows, weights=weights)
+                self.cohort_cube.add_complaints(delta_rows, weights=weights)
+        self._cube_row_hashes = row_hashes
+    
+    def _incremental_context_key(self, source_columns, options):
+        """影响处理结果的全部上下文: 数据列、SN数据库版本、分类规则和处理选项"""
+        rules = options.get('classification_rules') or DEFAULT_CLASSIFICATION_RULES
+        other_options = tuple(sorted(
+            (name, value) for name, value in options.items()
+            if name not in ('classification_rules', 'measure_memory')
+        ))
+        return (tuple(source_columns), self.sn_version, self.rules_key(rules), other_options)
+    
+    def iter_complaint_chunks(self, source, chunksize=50000):
+        """按固定行数分块读取客诉文件 (CSV或xlsx), 每块带有全局的原始行号
+        
+        各块独立推断类型会导致同一列在不同块中类型不一致, 因此原始列一律按文本读取
+        """
+        file_name = str(getattr(source, 'name', source)).lower()
+        
+        if file_name.endswith('.csv'):
+            chunks = pd.read_csv(source, chunksize=chunksize, dtype=str)
+        elif file_name.endswith('.xlsx'):
+            chunks = iter_xlsx_chunks(source, chunksize)
+        else:
+            # xls等格式不支持流式读取, 整体读取后再分块
+            whole_df = pd.read_excel(source)
+            chunks = (whole_df.iloc[start:start + chunksize] for start in range(0, len(whole_df), chunksize))
+        
+        row_offset = 0
+        for chunk in chunks:
+            chunk = chunk.reset_index(drop=True)
+            chunk = chunk.astype(str).where(chunk.notna())
+            chunk['原始行号'] = np.arange(row_offset, row_offset + len(chunk))
+            row_offset += len(chunk)
+            yield chunk
+    
+    def sn_info_columns(self, df_columns):
+        """SN信息补充可能产生的全部列名"""
+        info_columns = []
+        for sn_index in (self.sn_index_a, self.sn_index_b):
+            if sn_index is not None:
+                info_columns.extend(col for col in sn_index.columns if col not in df_columns)
+        return [f'SN信息_{col}' for col in dict.fromkeys(info_columns)]
+    
+    def process_complaints_streaming(self, source, output_path, chunksize=50000, **options):
+        """流式处理大文件: 分块读取 → 逐块清洗/SN补充/分类 → 增量写入Parquet文件
         
-        for code, std_type in product_code_patterns.items():
-            if code in desc.upper():
-                return std_type
+        内存占用只与chunksize有关, 与文件大小无关。options与process_complaints的参数相同
+        (measure_memory除外)。返回写入的总行数, 每块的统计记录在self.pipeline_stats中
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
         
-        return "其他"
+        writer = None
+        schema_columns = None
+        chunk_stats = []
+        total_rows = 0
+        
+        processed_chunks = (
+            (len(chunk), self.process_complaints(chunk, **options))
+            for chunk in self.iter_complaint_chunks(source, chunksize)
+        )
+        try:
+            for chunk_index, (input_rows, processed_df) in enumerate(processed_chunks, 1):
+                # 以第一块的列为准, SN信息列是否出现取决于该块是否有匹配, 需预先补齐
+                if schema_columns is None:
+                    schema_columns = list(processed_df.columns)
+                    if 'SN' in processed_df.columns and options.get('enrich_sn', True):
+                        schema_columns += [
+                            col for col in self.sn_info_columns(processed_df.columns)
+                            if col not in schema_columns
+                        ]
+                processed_df = self._to_parquet_frame(processed_df.reindex(columns=schema_columns))
+                
+                table = pa.Table.from_pandas(
+                    processed_df, schema=writer.schema if writer else None, preserve_index=False
+                )
+                if writer is None:
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                writer.write_table(table)
+                
+                total_rows += len(processed_df)
+                chunk_stats.append({
+                    '分块': chunk_index,
+                    '输入行数': input_rows,
+                    '输出行数': len(processed_df),
+                    '耗时(秒)': round(sum(stage['耗时(秒)'] for stage in self.pipeline_stats), 3),
+                    # 各块处理后的常驻内存, 不随已处理的块数增长
+                    '处理后常驻内存(MB)': _process_rss_mb(),
+                })
+        finally:
+            if writer is not None:
+                writer.close()
+        
+        self.pipeline_stats = chunk_stats
+        return total_rows
+    
+    @staticmethod
+    def _to_parquet_frame(df):
+        """统一各分块的列类型: 文本列和SN信息列一律写为字符串, 保证每块的Parquet结构一致"""
+        for col in df.columns:
+            dtype = df[col].dtype
+            is_text = dtype == object or pd.api.types.is_string_dtype(dtype)
+            if (is_text or col.startswith('SN信息_')) and not isinstance(dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype('string')
+        return df
+    
+    def standardize_machine_type(self, machine_desc):
+        """标准化机型描述"""
+        if pd.isna(machine_desc):
+            return "未知"
+        
+        return _match_machine_type(str(machine_desc))
+    
+    def standardize_machine_types(self, machine_series):
+        """按唯一值批量标准化机型列, 返回Categorical列"""
+        codes, uniques = pd.factorize(machine_series)
+        std_types = _expand_by_codes(codes, [self.standardize_machine_type(value) for value in uniques], "未知")
+        return pd.Series(
+            pd.Categorical(std_types, categories=MACHINE_TYPE_CATEGORIES),
+            index=machine_series.index
+        )
     
     def standardize_power(self, power_value):
         """标准化功率"""
@@ -153,152 +867,256 @@ class ComplaintDataProcessor:
         
         return power_num, unit
     
-    def enrich_with_sn_info(self, df):
+    def standardize_powers(self, power_series):
+        """按唯一值批量标准化功率列, 返回(功率_标准化, 功率单位)两列"""
+        codes, uniques = pd.factorize(power_series)
+        power_str = pd.Series(uniques, dtype=object).astype(str)
+        power_lower = power_str.str.lower()
+        
+        # 提取第一个数字
+        power_num = pd.to_numeric(power_str.str.extract(r'(\d+\.?\d*)', expand=False), errors='coerce')
+        
+        # 判断单位: 微逆使用W，其他使用KW
+        is_watt = power_lower.str.contains('w', regex=False) & ~power_lower.str.contains('kw', regex=False)
+        keep_watt = is_watt & power_lower.str.contains('微逆', regex=False)
+        power_num = power_num.where(~(is_watt & ~keep_watt), power_num / 1000)
+        unit = pd.Series(np.where(keep_watt, 'W', 'KW'), dtype=object).where(power_num.notna())
+        
+        power_num = _expand_by_codes(codes, power_num.to_numpy(dtype=float), np.nan)
+        unit = _expand_by_codes(codes, unit.to_numpy(dtype=object))
+        return (
+            pd.Series(power_num, index=power_series.index),
+            pd.Series(unit, index=power_series.index, dtype=object)
+        )
+    
+    def enrich_with_sn_info(self, df, copy=True):
         """根据SN补充信息"""
-        enriched_df = df.copy()
+        enriched_df = df.copy() if copy else df
+        
+        sn_keys = self.normalize_sn(enriched_df['SN'])
+        no_match = pd.Series(False, index=enriched_df.index)
         
         # 首先匹配数据库A
-        matched_info = []
-        for sn in enriched_df['SN']:
-            if pd.isna(sn):
-                matched_info.append({})
-                continue
-            
-            # 在数据库A中查找
-            match_a = None
-            if self.sn_database_a is not None:
-                match_a = self.sn_database_a[self.sn_database_a['SN'] == sn]
-            
-            # 在数据库B中查找 (微逆)
-            match_b = None
-            if self.sn_database_b is not None:
-                match_b = self.sn_database_b[self.sn_database_b['SN'] == sn]
-            
-            info = {}
-            if not match_a.empty:
-                info = match_a.iloc[0].to_dict()
-            
-            # 如果是微逆且数据库B有匹配，使用数据库B的信息
-            if not match_b.empty and ('微逆' in str(info.get('产品描述', '')) or '微逆' in str(enriched_df.get('机器型号', ''))):
-                info = match_b.iloc[0].to_dict()
-            
-            matched_info.append(info)
+        if self.sn_index_a is not None:
+            matched_a = self.sn_index_a.contains(sn_keys)
+        else:
+            matched_a = no_match
+        
+        # 在数据库B中查找 (微逆)
+        if self.sn_index_b is not None:
+            matched_b = self.sn_index_b.contains(sn_keys)
+        else:
+            matched_b = no_match
+        
+        # 如果是微逆且数据库B有匹配，使用数据库B的信息
+        is_micro = no_match
+        if '机器型号' in enriched_df.columns:
+            is_micro = enriched_df['机器型号'].astype(str).str.contains('微逆', regex=False)
+        if matched_a.any() and '产品描述' in self.sn_index_a.columns:
+            desc_a = self.sn_index_a.lookup(sn_keys.where(matched_a), columns=['产品描述'])['产品描述']
+            is_micro = is_micro | desc_a.astype(str).str.contains('微逆', regex=False).to_numpy()
+        use_b = matched_b & is_micro
+        use_a = matched_a & ~use_b
+        
+        # 一次性按索引取出匹配行 (按行位置对齐, 兼容重复索引)
+        info_parts = []
+        for sn_index, use in ((self.sn_index_a, use_a), (self.sn_index_b, use_b)):
+            if use.any():
+                part = sn_index.lookup(sn_keys[use])
+                part.index = np.flatnonzero(use.to_numpy())
+                info_parts.append(part)
+        
+        if not info_parts:
+            return enriched_df
+        
+        info_df = pd.concat(info_parts, sort=False).reindex(np.arange(len(enriched_df)))
+        info_df.index = enriched_df.index
         
         # 将匹配的信息合并到主表
-        info_df = pd.DataFrame(matched_info)
         for col in info_df.columns:
             if col not in enriched_df.columns:
                 enriched_df[f'SN信息_{col}'] = info_df[col]
         
         return enriched_df
     
-    def classify_complaints(self, df, classification_rules=None):
+    @staticmethod
+    def rules_key(classification_rules):
+        """分类规则的可哈希表示"""
+        return tuple((category, tuple(keywords)) for category, keywords in classification_rules.items())
+    
+    def get_classification_matcher(self, classification_rules):
+        """获取分类规则对应的匹配器 (相同规则只编译一次)"""
+        rules_key = self.rules_key(classification_rules)
+        if rules_key not in self._classification_matchers:
+            matcher = ClassificationMatcher(classification_rules)
+            self._classification_matchers[rules_key] = matcher
+            self._matchers_by_version[matcher.version] = matcher
+        return self._classification_matchers[rules_key]
+    
+    @staticmethod
+    def _text_or_empty(text_series):
+        """文本列转为字符串, 空值视为空字符串"""
+        return text_series.astype(str).where(text_series.notna(), '')
+    
+    def extract_production_months(self, sn_series):
+        """由SN前4位(年月, 如2308表示2023年8月)提取生产月份, 返回月度Period列
+        
+        前4位的取值很少, 只对唯一值解析日期后按编码映射回各行, 百万级SN也只解析几百个值
+        """
+        codes, date_codes = pd.factorize(self.normalize_sn(sn_series).str[:4])
+        date_code = pd.Series(date_codes, dtype=object).astype(str)
+        is_date = date_code.str.fullmatch(r'[0-9]{4}').fillna(False).astype(bool)
+        
+        year = pd.to_numeric(date_code.str[:2].where(is_date), errors='coerce')
+        month = pd.to_numeric(date_code.str[2:4].where(is_date), errors='coerce')
+        
+        # 处理2000年以后的年份
+        year = year + np.where(year < 50, 2000, 1900)
+        month = month.where((month >= 1) & (month <= 12))
+        
+        production_date = pd.to_datetime(
+            pd.DataFrame({'year': year, 'month': month, 'day': 1}), errors='coerce'
+        )
+        # 空SN (编码-1) 的生产月份为NaT
+        months = _expand_by_codes(codes, production_date.dt.to_period('M').array)
+        return pd.Series(months, index=sn_series.index)
+    
+    def update_cohort_population(self, shipment_df):
+        """按出货数据重建各生产批次的在役数量 (生产月份由SN推算, 机型优先使用标准化机型列)"""
+        if shipment_df is None or 'SN' not in shipment_df.columns:
+            self.cohort_cube.set_population(None)
+            return
+        
+        if '机型_标准化' in shipment_df.columns:
+            machine_types = shipment_df['机型_标准化']
+        elif '机器型号' in shipment_df.columns:
+            machine_types = self.standardize_machine_types(shipment_df['机器型号'])
+        else:
+            machine_types = pd.Series('未知', index=shipment_df.index)
+        self.cohort_cube.set_population(pd.DataFrame({
+            '生产日期': self.extract_production_months(shipment_df['SN']),
+            '机型_标准化': machine_types,
+        }))
+    
+    def calculate_cohort_failure_rates(self, machine_types=None, max_months_in_service=24, by_machine=True):
+        """生产批次累计失效率矩阵: 行为 生产月份(×机型), 列为服役月数, 值为累计失效率(%)"""
+        _, machine_types = _normalize_filters(machine_types=machine_types)
+        return self.cohort_cube.failure_matrix(machine_types, max_months_in_service, by_machine)
+    
+    def _combined_text(self, df):
+        """问题描述与解决办法拼接后的分类文本"""
+        return self._text_or_empty(df['问题描述']) + ' ' + self._text_or_empty(df['解决办法'])
+    
+    def reclassify_complaints(self, df, classification_rules, copy=True):
+        """分类规则修改后的增量重新分类
+        
+        根据每行记录的分类规则版本和命中关键词, 只重新判定可能改变分类的行:
+        命中了新增关键词的行, 以及原命中关键词已被删除的行。旧版本未知、数据中混有多个版本,
+        或保留关键词的顺序/分类发生变化时, 退回全量重新分类。统计记录在self.reclassify_stats中
+        """
+        reclassified_df = df.copy() if copy else df
+        if '问题描述' not in reclassified_df.columns or '解决办法' not in reclassified_df.columns:
+            return reclassified_df
+        
+        new_matcher = self.get_classification_matcher(classification_rules)
+        combined_text = self._combined_text(reclassified_df)
+        
+        changes = None
+        if {'问题分类', '命中关键词', '分类规则版本'}.issubset(reclassified_df.columns):
+            versions = reclassified_df['分类规则版本'].unique()
+            if len(versions) == 1 and versions[0] in self._matchers_by_version:
+                changes = new_matcher.diff(self._matchers_by_version[versions[0]])
+        
+        if changes is None:
+            needs_update = np.ones(len(reclassified_df), dtype=bool)
+            category_values = np.empty(len(reclassified_df), dtype=object)
+            keyword_values = np.empty(len(reclassified_df), dtype=object)
+        else:
+            added, removed = changes
+            needs_update = reclassified_df['命中关键词'].isin(removed).to_numpy(dtype=bool, copy=True)
+            if added:
+                _, added_hits = ClassificationMatcher({'新增关键词': added}).match(combined_text)
+                needs_update |= added_hits.notna().to_numpy(dtype=bool)
+            category_values = reclassified_df['问题分类'].to_numpy(dtype=object).copy()
+            keyword_values = reclassified_df['命中关键词'].to_numpy(dtype=object).copy()
+        
+        positions = np.flatnonzero(needs_update)
+        if len(positions):
+            categories, keywords = new_matcher.match(combined_text.iloc[positions])
+            category_values[positions] = categories.to_numpy()
+            keyword_values[positions] = keywords.to_numpy()
+        
+        reclassified_df['问题分类'] = pd.Series(category_values, index=reclassified_df.index)
+        reclassified_df['命中关键词'] = pd.Series(keyword_values, index=reclassified_df.index)
+        reclassified_df['分类规则版本'] = new_matcher.version
+        
+        self.reclassify_stats = {
+            '总行数': len(reclassified_df),
+            '重新判定行数': len(positions),
+            '全量重算': changes is None,
+            '规则版本': new_matcher.version,
+        }
+        return reclassified_df
+    
+    def classify_complaints(self, df, classification_rules=None, copy=True):
         """客诉数据自动分类 - A.3"""
-        classified_df = df.copy()
+        classified_df = df.copy() if copy else df
         
         # 默认分类规则
         if classification_rules is None:
-            classification_rules = {
-                '硬件故障': ['损坏', '故障', '不工作', '无响应', '短路', '断路'],
-                '软件问题': ['程序', '软件', '固件', '升级', '版本', 'bug'],
-                '安装问题': ['安装', '接线', '连接', '配置', '设置'],
-                '性能问题': ['效率低', '功率不足', '过热', '噪音'],
-                '外观问题': ['划伤', '变形', '颜色', '外观'],
-                '其他': []  # 默认分类
-            }
-        
-        def assign_category(problem_desc, solution_desc):
-            if pd.isna(problem_desc):
-                problem_desc = ''
-            if pd.isna(solution_desc):
-                solution_desc = ''
-            
-            combined_text = f"{problem_desc} {solution_desc}".lower()
-            
-            for category, keywords in classification_rules.items():
-                for keyword in keywords:
-                    if keyword.lower() in combined_text:
-                        return category
-            
-            return '其他'
+            classification_rules = DEFAULT_CLASSIFICATION_RULES
         
         # 应用分类
         if '问题描述' in classified_df.columns and '解决办法' in classified_df.columns:
-            classified_df['问题分类'] = classified_df.apply(
-                lambda row: assign_category(row.get('问题描述', ''), row.get('解决办法', '')),
-                axis=1
-            )
+            matcher = self.get_classification_matcher(classification_rules)
+            combined_text = self._combined_text(classified_df)
+            classified_df['问题分类'], classified_df['命中关键词'] = matcher.match(combined_text)
+            classified_df['分类规则版本'] = matcher.version
         
         # 提取告警代码
         if '问题描述' in classified_df.columns:
-            def extract_alarm_code(text):
-                if pd.isna(text):
-                    return None
-                
-                # 查找常见的告警代码模式
-                patterns = [
-                    r'ERR\d{2,4}',  # ERR001, ERR1234
-                    r'ALM\d{2,4}',   # ALM001
-                    r'F\d{2,4}',     # F001, F123
-                    r'E\d{2,4}',     # E001
-                    r'代码[：:]\s*(\w+)',  # 代码: ERR001
-                    r'报警[：:]\s*(\w+)',  # 报警: ERR001
-                ]
-                
-                for pattern in patterns:
-                    matches = re.findall(pattern, str(text), re.IGNORECASE)
-                    if matches:
-                        return matches[0]
-                
-                return None
-            
-            classified_df['告警代码'] = classified_df['问题描述'].apply(extract_alarm_code)
+            desc = classified_df['问题描述']
+            alarm_matches = desc.astype(str).where(desc.notna()).str.extract(ALARM_CODE_PATTERN)
+            alarm_code = alarm_matches[0]
+            for col in alarm_matches.columns[1:]:
+                alarm_code = alarm_code.fillna(alarm_matches[col])
+            classified_df['告警代码'] = alarm_code.astype(object)
         
         # 提取生产日期 (SN前4位)
         if 'SN' in classified_df.columns:
-            def extract_production_date(sn):
-                if pd.isna(sn) or len(str(sn)) < 4:
-                    return None
-                
-                sn_str = str(sn)
-                date_code = sn_str[:4]
-                
-                # 假设前4位是年月，如2308表示2023年8月
-                if date_code.isdigit():
-                    year = int(date_code[:2])
-                    month = int(date_code[2:4])
-                    
-                    # 处理2000年以后的年份
-                    if 0 <= year <= 99:
-                        full_year = 2000 + year if year < 50 else 1900 + year
-                        return f"{full_year}-{month:02d}"
-                
-                return None
-            
-            classified_df['生产日期'] = classified_df['SN'].apply(extract_production_date)
+            classified_df['生产日期'] = self.extract_production_months(classified_df['SN'])
         
         return classified_df
     
-    def calculate_defect_rate(self, complaint_df, shipment_df, period, machine_types):
-        """计算不良率 - B.1"""
+    def calculate_defect_rate(self, complaint_df, shipment_df, period, machine_types, cube=None):
+        """计算不良率 - B.1
+        
+        传入cube (AnalysisCube) 时直接由预汇总计数计算, 不使用明细数据
+        """
+        
+        if cube is not None:
+            months, _ = _normalize_filters(period)
+            complaint_counts = cube.complaints(months=months, by='机型_标准化').rename('客诉数').reset_index()
+            shipment_counts = cube.shipments(by='机型_标准化').rename('出货数').reset_index()
+            return self.calculate_defect_rate_from_counts(complaint_counts, shipment_counts, machine_types)
         
         if complaint_df.empty or shipment_df.empty:
             return pd.DataFrame()
         
-        # 过滤指定期间的数据
-        if '客诉时间' in complaint_df.columns:
-            # 假设客诉时间是日期字符串
-            complaint_df['客诉日期'] = pd.to_datetime(complaint_df['客诉时间'], errors='coerce')
+        # 过滤指定期间的客诉 (period为"YYYY-MM", 为空或"全部月份"时不过滤)
+        if period not in (None, ALL_MONTHS) and '客诉时间' in complaint_df.columns:
+            complaint_months = pd.to_datetime(complaint_df['客诉时间'], errors='coerce').dt.to_period('M')
+            complaint_df = complaint_df[complaint_months == pd.Period(period, 'M')]
         
         # 按机型统计不良数
         if '机型_标准化' in complaint_df.columns:
-            defect_counts = complaint_df.groupby('机型_标准化').size().reset_index(name='不良数')
+            defect_counts = complaint_df.groupby('机型_标准化', observed=True).size().reset_index(name='不良数')
         else:
             defect_counts = pd.DataFrame({'机型_标准化': [], '不良数': []})
         
         # 按机型统计出货数
         if '机型_标准化' in shipment_df.columns:
-            shipment_counts = shipment_df.groupby('机型_标准化').size().reset_index(name='出货数')
+            shipment_counts = shipment_df.groupby('机型_标准化', observed=True).size().reset_index(name='出货数')
         else:
             shipment_counts = pd.DataFrame({'机型_标准化': [], '出货数': []})
         
@@ -306,20 +1124,109 @@ class ComplaintDataProcessor:
         result = pd.merge(defect_counts, shipment_counts, on='机型_标准化', how='outer')
         result = result.fillna(0)
         
-        # 计算不良率
-        result['不良率(%)'] = result.apply(
-            lambda row: (row['不良数'] / row['出货数'] * 100) if row['出货数'] > 0 else 0,
-            axis=1
-        )
+        # 计算不良率 (无出货的机型记为0)
+        shipped = result['出货数'].where(result['出货数'] > 0)
+        result['不良率(%)'] = (result['不良数'] / shipped * 100).fillna(0)
+        
+        # 过滤指定机型 (选择"全部机型"时不过滤)
+        _, machine_types = _normalize_filters(machine_types=machine_types)
+        if machine_types:
+            result = result[result['机型_标准化'].isin(machine_types)]
         
-        # 过滤指定机型
-        if machine_types and '全部' not in machine_types:
+        return result
+    
+    def calculate_defect_rate_from_counts(self, complaint_counts, shipment_counts, machine_types):
+        """由汇总计数计算不良率 (输出与calculate_defect_rate一致), 无需获取明细数据
+        
+        complaint_counts需包含 机型_标准化/客诉数 列, shipment_counts需包含 机型_标准化/出货数 列
+        """
+        
+        if complaint_counts.empty or shipment_counts.empty:
+            return pd.DataFrame()
+        
+        defect_counts = complaint_counts.groupby('机型_标准化')['客诉数'].sum().rename('不良数')
+        shipped_counts = shipment_counts.groupby('机型_标准化')['出货数'].sum()
+        
+        result = pd.concat([defect_counts, shipped_counts], axis=1).fillna(0)
+        result.index.name = '机型_标准化'
+        result = result.reset_index()
+        
+        shipped = result['出货数'].where(result['出货数'] > 0)
+        result['不良率(%)'] = (result['不良数'] / shipped * 100).fillna(0)
+        
+        # 过滤指定机型 (选择"全部机型"时不过滤)
+        _, machine_types = _normalize_filters(machine_types=machine_types)
+        if machine_types:
             result = result[result['机型_标准化'].isin(machine_types)]
         
         return result
     
-    def analyze_concentrated_issues(self, complaint_df, month=None, machine_type=None):
-        """集中性问题分析 - B.2"""
+    def calculate_defect_rate_trend(self, cube, windows=DEFECT_RATE_WINDOWS, shipment_lag=0, machine_types=None):
+        """按月份和机型计算滚动窗口不良率, 一次性覆盖全部历史月份
+        
+        每个窗口w的不良率 = 最近w个月的客诉数之和 / 对应w个月的出货数之和;
+        shipment_lag为N时, 客诉月份与N个月前的出货对齐 (出货后一段时间才会产生客诉)。
+        另有"全部机型"汇总行。月份范围为客诉数据覆盖的月份, 无出货的月份不良率为空;
+        起始的前w-1个月不足一个完整窗口, 不输出。
+        返回长表: 月份, 机型_标准化, 窗口(月), 不良数, 出货数, 不良率(%)
+        """
+        complaints = cube.complaints(by=['月份', '机型_标准化'])
+        shipments = cube.shipments(by=['月份', '机型_标准化'])
+        
+        def monthly_matrix(counts):
+            # 月份 × 机型的计数矩阵, 不含未知月份
+            counts = counts[counts.index.get_level_values('月份') != '未知']
+            matrix = counts.unstack('机型_标准化', fill_value=0)
+            matrix.index = pd.PeriodIndex(matrix.index, freq='M')
+            return matrix
+        
+        complaint_matrix = monthly_matrix(complaints)
+        shipment_matrix = monthly_matrix(shipments)
+        if complaint_matrix.empty:
+            return pd.DataFrame(columns=['月份', '机型_标准化', '窗口(月)', '不良数', '出货数', '不良率(%)'])
+        
+        # 补齐连续月份和机型, 使滚动窗口按自然月计算; 月份范围以客诉数据为准,
+        # 最后一个客诉月份之后尚无观测, 不能因为只有出货而算作0%不良率
+        months = pd.period_range(complaint_matrix.index.min(), complaint_matrix.index.max(), freq='M')
+        machines = complaint_matrix.columns.union(shipment_matrix.columns)
+        _, machine_types = _normalize_filters(machine_types=machine_types)
+        if machine_types:
+            machines = machines[machines.isin(machine_types)]
+        
+        complaint_matrix = complaint_matrix.reindex(index=months, columns=machines, fill_value=0)
+        # 出货月份整体后移shipment_lag个月, 与客诉月份对齐
+        shipment_matrix = shipment_matrix.reindex(
+            index=months - shipment_lag, columns=machines, fill_value=0
+        ).set_axis(months, axis=0)
+        complaint_matrix['全部机型'] = complaint_matrix.sum(axis=1)
+        shipment_matrix['全部机型'] = shipment_matrix.sum(axis=1)
+        
+        results = []
+        for window in windows:
+            # 只保留覆盖满window个月的窗口, 避免把不足窗口长度的比率当作该窗口的不良率
+            window_complaints = complaint_matrix.rolling(window).sum().iloc[window - 1:]
+            window_shipments = shipment_matrix.rolling(window).sum().iloc[window - 1:]
+            window_rates = window_complaints / window_shipments.where(window_shipments > 0) * 100
+            results.append(pd.DataFrame({
+                '不良数': window_complaints.stack(),
+                '出货数': window_shipments.stack(),
+                '不良率(%)': window_rates.stack(),
+            }).assign(**{'窗口(月)': window}))
+        
+        trend = pd.concat(results).rename_axis(['月份', '机型_标准化']).reset_index()
+        trend['月份'] = trend['月份'].astype(str)
+        trend[['不良数', '出货数']] = trend[['不良数', '出货数']].astype('int64')
+        return trend[['月份', '机型_标准化', '窗口(月)', '不良数', '出货数', '不良率(%)']]
+    
+    def analyze_concentrated_issues(self, complaint_df, month=None, machine_type=None, cube=None):
+        """集中性问题分析 - B.2
+        
+        传入cube (AnalysisCube) 时问题统计由预汇总计数得出 (machine_type可为机型列表),
+        complaint_df只用于提取具体案例; 两种方式的计数口径不同, 见_analyze_concentrated_issues_from_cube
+        """
+        
+        if cube is not None:
+            return self._analyze_concentrated_issues_from_cube(complaint_df, month, machine_type, cube)
         
         if complaint_df.empty:
             return pd.DataFrame(), pd.DataFrame()
@@ -347,3 +1254,38 @@ class ComplaintDataProcessor:
             case_details[issue] = cases
         
         return issue_stats, concentrated_issues, case_details
+    
+    def _analyze_concentrated_issues_from_cube(self, complaint_df, month, machine_type, cube):
+        """由预汇总计数做集中性问题分析, 输出的表结构与analyze_concentrated_issues相同
+        
+        计数口径与不良率统计一致: 每条客诉计1 (不要求SN非空), 问题分类为空的计入"未分类",
+        占比和集中性阈值以过滤后的客诉总数为基准。未传入cube时按SN非空的行计数, 因此SN缺失较多时数量会偏少
+        """
+        # machine_type可以是单个机型或机型列表
+        months, machine_types = _normalize_filters(month, machine_type)
+        counts = cube.complaints(months=months, machine_types=machine_types, by=['问题分类', '机型_标准化'])
+        
+        if counts.empty:
+            return pd.DataFrame(), pd.DataFrame(), {}
+        
+        # 各问题分类的数量及数量最多的机型
+        issue_counts = counts.groupby(level='问题分类').sum()
+        main_machine = counts.sort_values(ascending=False, kind='stable').reset_index() \
+            .drop_duplicates('问题分类').set_index('问题分类')['机型_标准化']
+        issue_stats = pd.DataFrame({'问题数量': issue_counts, '机型_标准化': main_machine})
+        issue_stats.index.name = '问题分类'
+        
+        total = issue_counts.sum()
+        issue_stats['占比(%)'] = (issue_stats['问题数量'] / total * 100).round(2)
+        issue_stats = issue_stats.sort_values('问题数量', ascending=False)
+        
+        threshold = max(3, total * 0.05)  # 至少3个或5%
+        concentrated_issues = issue_stats[issue_stats['问题数量'] >= threshold].copy()
+        
+        case_details = {}
+        if complaint_df is not None and '问题分类' in complaint_df.columns:
+            case_columns = [col for col in ['SN', '问题描述', '客诉时间', '机型_标准化'] if col in complaint_df.columns]
+            for issue in concentrated_issues.index:
+                case_details[issue] = complaint_df[complaint_df['问题分类'] == issue][case_columns].head(10)
+        
+        return issue_stats, concentrated_issues, case_details
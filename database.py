@@ -1,35 +1,330 @@
 import os
+import time
+import threading
 import pandas as pd
+from collections import OrderedDict
+from contextlib import nullcontext
+from itertools import chain
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from supabase import create_client, Client
 from datetime import datetime
 import streamlit as st
+from local_database import LocalDatabaseClient, derive_indexed_columns
 
-class ComplaintDatabase:
+# 批量上传默认参数
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 1.0
+
+# 服务端汇总视图 (在Supabase SQL编辑器中执行一次)
+AGGREGATE_VIEWS_SQL = """
+create or replace view complaint_monthly_counts as
+select date_trunc('month', complain_date)::date as month,
+       machine_type_std,
+       problem_category,
+       count(*) as complaint_count
+from complaints
+group by 1, 2, 3;
+
+create or replace view shipment_monthly_counts as
+select date_trunc('month', shipment_date)::date as month,
+       machine_type_std,
+       count(*) as shipment_count
+from shipments
+group by 1, 2;
+"""
+
+# 汇总视图列名 → 分析页面使用的中文列名 (最后一列为计数)
+AGGREGATE_VIEW_COLUMNS = {
+    'complaint_monthly_counts': {
+        'month': '月份', 'machine_type_std': '机型_标准化', 'problem_category': '问题分类',
+        'complaint_count': '客诉数',
+    },
+    'shipment_monthly_counts': {
+        'month': '月份', 'machine_type_std': '机型_标准化', 'shipment_count': '出货数',
+    },
+}
+
+# 各表的自然键: 自然键相同的行视为同一条记录, 重复上传时更新而不是新增
+# 同一文件内自然键重复的行按出现次序区分; 数据中缺少配置的任一列时, 以整行内容及其出现次序作为键
+NATURAL_KEYS = {
+    'complaints': ('SN', '客诉时间'),
+    'shipments': ('SN', '出货时间'),
+    'sn_database_a': ('SN',),
+    'sn_database_b': ('SN',),
+}
+
+# 幂等上传使用的列: 自然键哈希 (唯一) 和整行内容哈希
+ROW_KEY_COLUMN = 'row_key'
+ROW_HASH_COLUMN = 'row_hash'
+
+# 在Supabase中为各表添加上述两列及唯一约束 (执行一次)
+UPSERT_COLUMNS_SQL = """
+alter table {table} add column if not exists row_key text unique;
+alter table {table} add column if not exists row_hash text;
+"""
+
+# 查询结果缓存默认参数: 最多缓存的查询数和有效期(秒)
+DEFAULT_CACHE_SIZE = 32
+DEFAULT_CACHE_TTL = 300
+
+# 分页读取默认每页行数 (PostgREST默认单次最多返回1000行)
+DEFAULT_PAGE_SIZE = 1000
+
+class QueryCache:
+    """查询结果缓存 (线程安全): 按查询参数缓存DataFrame, 超过有效期或容量时淘汰最久未使用的结果
+    
+    每张表有一个版本号, 上传数据时递增并清除该表的缓存; 查询开始后表被更新的, 结果不写入缓存
+    """
+    
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def version(self, table_name):
+        with self.lock:
+            return self.versions.get(table_name, 0)
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, key, table_name, version, value):
+        with self.lock:
+            if self.versions.get(table_name, 0) != version:
+                return
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+    
+    def invalidate(self, table_name):
+        """清除涉及该表的缓存结果 (键的第一项为表名)"""
+        with self.lock:
+            self.versions[table_name] = self.versions.get(table_name, 0) + 1
+            for key in [key for key in self.entries if key[0] == table_name]:
+                del self.entries[key]
+
+
+class UploadJob:
+    """后台上传任务: 每张表一个Future, 各表的上传进度可在主线程中随时读取"""
+    
     def __init__(self):
+        self.futures = {}
+        self.progress = {}
+        self.lock = threading.Lock()
+    
+    def update(self, table_name, uploaded_rows, total_rows):
+        with self.lock:
+            self.progress[table_name] = (uploaded_rows, total_rows)
+    
+    def snapshot(self):
+        """各表当前进度: {表名: (已上传行数, 总行数)}"""
+        with self.lock:
+            return dict(self.progress)
+    
+    def done(self):
+        return all(future.done() for future in self.futures.values())
+    
+    def wait(self):
+        for future in self.futures.values():
+            future.exception()
+    
+    def result(self):
+        """等待所有表上传完成, 返回(是否全部成功, 汇总信息)"""
+        messages = []
+        success = True
+        for table_name, future in self.futures.items():
+            try:
+                table_success, message = future.result()
+            except Exception as e:
+                table_success, message = False, str(e)
+            success &= table_success
+            messages.append(f"{table_name}: {message}")
+        return success, "; ".join(messages)
+
+
+class ComplaintDatabase:
+    def __init__(self, client=None, local_db_path=None,
+                 cache_size=DEFAULT_CACHE_SIZE, cache_ttl=DEFAULT_CACHE_TTL):
+        # 查询结果缓存, 同一实例在多个会话间共享时各会话共用查询结果
+        self.query_cache = QueryCache(cache_size, cache_ttl)
+        
+        # 可直接传入客户端 (如测试用的本地替身), 否则按配置创建Supabase客户端
+        if client is not None:
+            self.supabase = client
+            return
+        
         # Supabase配置 (从环境变量或Streamlit secrets获取)
         try:
             self.supabase_url = st.secrets["supabase"]["url"]
             self.supabase_key = st.secrets["supabase"]["key"]
             self.supabase: Client = create_client(self.supabase_url, self.supabase_key)
         except:
-            # 本地开发时使用模拟数据
-            self.supabase = None
-            st.warning("Supabase配置未找到，使用模拟数据模式")
+            if local_db_path:
+                # 本地部署时使用嵌入式SQLite数据库 (支持过滤下推, 重启后数据仍在)
+                self.supabase = LocalDatabaseClient(local_db_path)
+                st.info(f"Supabase配置未找到，使用本地数据库: {local_db_path}")
+            else:
+                # 本地开发时使用模拟数据
+                self.supabase = None
+                st.warning("Supabase配置未找到，使用模拟数据模式")
     
     def create_tables(self):
         """创建数据库表结构"""
         # 在实际使用中，这里应该是SQL创建语句
-        # 现在先用DataFrame模拟
+        # 现在先用DataFrame模拟; 汇总视图需在Supabase SQL编辑器中执行AGGREGATE_VIEWS_SQL创建
         return True
     
-    def upload_complaint_data(self, df, table_name="complaints"):
-        """上传客诉数据到数据库"""
+    def bulk_insert(self, df, table_name, batch_size=DEFAULT_BATCH_SIZE, max_workers=DEFAULT_MAX_WORKERS,
+                    max_retries=DEFAULT_MAX_RETRIES, retry_backoff=DEFAULT_RETRY_BACKOFF,
+                    progress_callback=None, on_conflict=None, executor=None):
+        """分批上传数据
+        
+        每批最多batch_size行, 最多max_workers个批次同时发送; 失败的批次按指数退避重试max_retries次。
+        progress_callback(已上传行数, 总行数)在每个批次完成后调用。
+        指定on_conflict (唯一列名) 时以upsert方式写入, 该列相同的行覆盖已有记录。
+        传入executor时批次提交到该线程池 (多张表共用, 总并发数由该线程池限制)。
+        返回(是否全部成功, 失败批次数, 最后一个失败批次的错误信息)
+        """
+        total_rows = len(df)
+        uploaded_rows = 0
+        if progress_callback:
+            progress_callback(uploaded_rows, total_rows)
+        
+        failed_batches = 0
+        last_error = None
+        with nullcontext(executor) if executor else ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    self._insert_batch, table_name, df.iloc[start:start + batch_size],
+                    max_retries, retry_backoff, on_conflict
+                ): start
+                for start in range(0, total_rows, batch_size)
+            }
+            for future in as_completed(futures):
+                start = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    failed_batches += 1
+                    last_error = str(e)
+                    continue
+                
+                uploaded_rows += min(batch_size, total_rows - start)
+                if progress_callback:
+                    progress_callback(uploaded_rows, total_rows)
+        
+        return failed_batches == 0, failed_batches, last_error
+    
+    def _insert_batch(self, table_name, batch_df, max_retries, retry_backoff, on_conflict=None):
+        """发送一个批次, 失败时按指数退避重试"""
+        records = self._to_records(table_name, batch_df)
+        for attempt in range(max_retries + 1):
+            try:
+                table = self.supabase.table(table_name)
+                if on_conflict:
+                    return table.upsert(records, on_conflict=on_conflict).execute()
+                return table.insert(records).execute()
+            except Exception:
+                if attempt == max_retries:
+                    raise
+                time.sleep(retry_backoff * 2 ** attempt)
+    
+    @staticmethod
+    def _to_records(table_name, batch_df):
+        """转换为可JSON序列化的字典列表: 派生过滤和汇总视图所用的列, 日期和周期转为字符串, 空值转为None"""
+        batch_df = derive_indexed_columns(table_name, batch_df.copy())
+        for col in batch_df.columns:
+            dtype = batch_df[col].dtype
+            if pd.api.types.is_datetime64_any_dtype(dtype) or isinstance(dtype, pd.PeriodDtype):
+                batch_df[col] = batch_df[col].astype(str).where(batch_df[col].notna())
+        batch_df = batch_df.astype(object).where(batch_df.notna(), None)
+        return batch_df.to_dict('records')
+    
+    @staticmethod
+    def row_keys(df, key_columns):
+        """计算每行的自然键哈希和整行内容哈希 (16位十六进制字符串)
+        
+        先统一转为字符串再哈希, 同一文件无论按何种类型读入, 哈希都相同
+        """
+        content = df.drop(columns=[ROW_KEY_COLUMN, ROW_HASH_COLUMN], errors='ignore').astype(str)
+        row_hash = pd.util.hash_pandas_object(content, index=False)
+        if key_columns and all(col in content.columns for col in key_columns):
+            row_key = pd.util.hash_pandas_object(content[list(key_columns)], index=False)
+            # 自然键重复的行 (如同一SN在同一天的两条客诉) 按出现次序区分, 不会合并为一行;
+            # 第一次出现的行保持原有的键, 与之前上传的记录一致
+            occurrence = row_key.groupby(row_key.to_numpy()).cumcount()
+            repeated = (occurrence > 0).to_numpy()
+            if repeated.any():
+                row_key = row_key.copy()
+                row_key[repeated] = pd.util.hash_pandas_object(
+                    pd.DataFrame({'hash': row_key[repeated], 'n': occurrence[repeated]}), index=False
+                ).to_numpy()
+        else:
+            # 完全相同的行按出现次序区分, 累计文件重复上传时仍一一对应, 不会合并为一行
+            occurrence = row_hash.groupby(row_hash.to_numpy()).cumcount()
+            row_key = pd.util.hash_pandas_object(pd.DataFrame({'hash': row_hash, 'n': occurrence}), index=False)
+        to_hex = lambda hashes: pd.Series([f"{value:016x}" for value in hashes.to_numpy()], index=df.index)
+        return to_hex(row_key), to_hex(row_hash)
+    
+    def changed_rows(self, df, table_name, key_columns=None):
+        """找出需要写入的行: 与表中已有记录对比, 只保留新增的和内容有变化的行
+        
+        返回带row_key/row_hash列的数据
+        """
+        if key_columns is None:
+            key_columns = NATURAL_KEYS.get(table_name)
+        row_key, row_hash = self.row_keys(df, key_columns)
+        keyed = df.assign(**{ROW_KEY_COLUMN: row_key, ROW_HASH_COLUMN: row_hash})
+        
+        # 只获取已有记录的两个哈希列, 在本地比对
+        pages = self._iter_page_records(table_name, None, None, None, None, [ROW_KEY_COLUMN, ROW_HASH_COLUMN],
+                                        DEFAULT_PAGE_SIZE, DEFAULT_MAX_WORKERS)
+        stored = pd.DataFrame(list(chain.from_iterable(pages)), columns=[ROW_KEY_COLUMN, ROW_HASH_COLUMN])
+        stored_hash = stored.dropna().drop_duplicates(ROW_KEY_COLUMN).set_index(ROW_KEY_COLUMN)[ROW_HASH_COLUMN]
+        
+        unchanged = keyed[ROW_KEY_COLUMN].map(stored_hash) == keyed[ROW_HASH_COLUMN]
+        return keyed[~unchanged]
+    
+    def upload_complaint_data(self, df, table_name="complaints", batch_size=DEFAULT_BATCH_SIZE,
+                              max_workers=DEFAULT_MAX_WORKERS, progress_callback=None, key_columns=None,
+                              executor=None):
+        """上传客诉数据到数据库
+        
+        按自然键 (key_columns, 默认见NATURAL_KEYS) 幂等写入: 只发送新增和内容变化的行,
+        已有记录被更新而不是重复新增, 累计文件重复上传不会产生重复数据
+        """
         if self.supabase:
             try:
-                # 转换为字典列表格式
-                records = df.to_dict('records')
-                response = self.supabase.table(table_name).insert(records).execute()
-                return True, f"成功上传 {len(records)} 条记录"
+                changed = self.changed_rows(df, table_name, key_columns)
+                skipped = len(df) - len(changed)
+                try:
+                    # 重新上传时已写入的行哈希一致而被跳过, 只发送尚未写入的行
+                    success, failed_batches, last_error = self.bulk_insert(
+                        changed, table_name, batch_size=batch_size, max_workers=max_workers,
+                        progress_callback=progress_callback, on_conflict=ROW_KEY_COLUMN, executor=executor
+                    )
+                finally:
+                    # 部分批次写入后失败也会改变表内容
+                    self.query_cache.invalidate(table_name)
+                if not success:
+                    return False, (f"{failed_batches} 个批次上传失败 (最后一个错误: {last_error})，"
+                                   f"重新上传时只发送尚未写入的记录")
+                return True, f"成功写入 {len(changed)} 条新增或变化的记录，跳过 {skipped} 条未变化的记录"
             except Exception as e:
                 return False, str(e)
         else:
@@ -37,22 +332,24 @@ class ComplaintDatabase:
             st.session_state[f"{table_name}_data"] = df
             return True, f"模拟上传 {len(df)} 条记录到 {table_name}"
     
-    def upload_shipment_data(self, df, table_name="shipments"):
+    def upload_shipment_data(self, df, table_name="shipments", batch_size=DEFAULT_BATCH_SIZE,
+                             max_workers=DEFAULT_MAX_WORKERS, progress_callback=None, key_columns=None):
         """上传出货数据到数据库"""
-        return self.upload_complaint_data(df, table_name)
+        return self.upload_complaint_data(df, table_name, batch_size, max_workers, progress_callback, key_columns)
     
-    def upload_sn_database(self, df_a, df_b=None):
+    def upload_sn_database(self, df_a, df_b=None, batch_size=DEFAULT_BATCH_SIZE,
+                           max_workers=DEFAULT_MAX_WORKERS, progress_callback=None):
         """上传SN数据库"""
         if self.supabase:
-            # 上传数据库A
-            if df_a is not None:
-                records_a = df_a.to_dict('records')
-                self.supabase.table("sn_database_a").insert(records_a).execute()
-            
-            # 上传数据库B (微逆)
-            if df_b is not None:
-                records_b = df_b.to_dict('records')
-                self.supabase.table("sn_database_b").insert(records_b).execute()
+            # 上传数据库A, 再上传数据库B (微逆)
+            for table_name, sn_df in (("sn_database_a", df_a), ("sn_database_b", df_b)):
+                if sn_df is None:
+                    continue
+                success, message = self.upload_complaint_data(
+                    sn_df, table_name, batch_size, max_workers, progress_callback
+                )
+                if not success:
+                    return False, f"{table_name}: {message}"
             return True, "SN数据库上传成功"
         else:
             # 模拟模式
@@ -61,38 +358,243 @@ class ComplaintDatabase:
                 st.session_state["sn_database_b"] = df_b
             return True, "SN数据库模拟上传成功"
     
-    def get_complaint_data(self, start_date=None, end_date=None, machine_type=None):
-        """获取客诉数据"""
-        if self.supabase:
-            query = self.supabase.table("complaints").select("*")
-            
-            if start_date:
-                query = query.gte("complain_date", start_date)
-            if end_date:
-                query = query.lte("complain_date", end_date)
-            if machine_type:
-                query = query.eq("machine_type_std", machine_type)
-                
-            response = query.execute()
-            return pd.DataFrame(response.data)
+    def start_sn_upload(self, df_a, df_b=None, batch_size=DEFAULT_BATCH_SIZE, max_workers=DEFAULT_MAX_WORKERS):
+        """在后台并发上传SN数据库A和B, 立即返回UploadJob
+        
+        两张表同时上传, 所有批次共用一个线程池, 同时进行的请求不超过max_workers个;
+        调用方可在上传期间做其他工作 (如建立SN索引), 并通过UploadJob轮询各表进度
+        """
+        tables = {name: sn_df for name, sn_df in (("sn_database_a", df_a), ("sn_database_b", df_b))
+                  if sn_df is not None}
+        job = UploadJob()
+        
+        if not self.supabase:
+            # 模拟模式: 直接写入会话状态 (会话状态只能在当前线程中修改)
+            self.upload_sn_database(df_a, df_b)
+            for table_name, sn_df in tables.items():
+                future = Future()
+                future.set_result((True, f"模拟上传 {len(sn_df)} 条记录到 {table_name}"))
+                job.futures[table_name] = future
+                job.update(table_name, len(sn_df), len(sn_df))
+            return job
+        
+        batch_executor = ThreadPoolExecutor(max_workers=max_workers)
+        table_executor = ThreadPoolExecutor(max_workers=max(len(tables), 1))
+        
+        def upload(table_name, sn_df):
+            return self.upload_complaint_data(
+                sn_df, table_name, batch_size, max_workers,
+                progress_callback=lambda uploaded, total: job.update(table_name, uploaded, total),
+                executor=batch_executor
+            )
+        
+        for table_name, sn_df in tables.items():
+            job.update(table_name, 0, len(sn_df))
+            job.futures[table_name] = table_executor.submit(upload, table_name, sn_df)
+        # 线程池在已提交的任务执行完后关闭, 不阻塞调用方
+        table_executor.shutdown(wait=False)
+        batch_executor_closer = threading.Thread(
+            target=lambda: (job.wait(), batch_executor.shutdown()), daemon=True
+        )
+        batch_executor_closer.start()
+        return job
+    
+    def get_complaint_data(self, start_date=None, end_date=None, machine_type=None, columns=None,
+                           page_size=DEFAULT_PAGE_SIZE, max_workers=DEFAULT_MAX_WORKERS):
+        """获取客诉数据 (columns指定时只获取这些列)"""
+        return self._fetch_table("complaints", "complain_date", start_date, end_date, machine_type,
+                                 columns, page_size, max_workers)
+    
+    def get_shipment_data(self, start_date=None, end_date=None, machine_type=None, columns=None,
+                          page_size=DEFAULT_PAGE_SIZE, max_workers=DEFAULT_MAX_WORKERS):
+        """获取出货数据 (columns指定时只获取这些列)"""
+        return self._fetch_table("shipments", "shipment_date", start_date, end_date, machine_type,
+                                 columns, page_size, max_workers)
+    
+    def iter_complaint_pages(self, start_date=None, end_date=None, machine_type=None, columns=None,
+                             page_size=DEFAULT_PAGE_SIZE, max_workers=DEFAULT_MAX_WORKERS):
+        """逐页获取客诉数据, 每页为一个DataFrame, 可边获取边统计"""
+        for records in self._iter_page_records("complaints", "complain_date", start_date, end_date,
+                                               machine_type, columns, page_size, max_workers):
+            yield pd.DataFrame(records)
+    
+    def iter_shipment_pages(self, start_date=None, end_date=None, machine_type=None, columns=None,
+                            page_size=DEFAULT_PAGE_SIZE, max_workers=DEFAULT_MAX_WORKERS):
+        """逐页获取出货数据, 每页为一个DataFrame, 可边获取边统计"""
+        for records in self._iter_page_records("shipments", "shipment_date", start_date, end_date,
+                                               machine_type, columns, page_size, max_workers):
+            yield pd.DataFrame(records)
+    
+    def get_complaint_counts(self, start_date=None, end_date=None, machine_type=None):
+        """获取按月份、机型、问题分类汇总的客诉数 (服务端聚合视图, 只传输汇总结果)"""
+        return self._fetch_counts("complaint_monthly_counts", "complaints", start_date, end_date, machine_type)
+    
+    def get_shipment_counts(self, start_date=None, end_date=None, machine_type=None):
+        """获取按月份、机型汇总的出货数 (服务端聚合视图, 只传输汇总结果)"""
+        return self._fetch_counts("shipment_monthly_counts", "shipments", start_date, end_date, machine_type)
+    
+    def _fetch_counts(self, view_name, table_name, start_date, end_date, machine_type):
+        """读取汇总视图, 列名统一为中文; 模拟模式下在本地汇总"""
+        count_columns = AGGREGATE_VIEW_COLUMNS[view_name]
+        
+        if not self.supabase:
+            # 模拟模式
+            counts = self._local_counts(st.session_state.get(f"{table_name}_data", pd.DataFrame()), count_columns)
         else:
+            # 视图的month为当月第一天, 起始日期需对齐到月初才能包含起始月
+            if start_date:
+                start_date = pd.Period(start_date, 'M').start_time.date().isoformat()
+            
+            def fetch():
+                pages = self._iter_page_records(view_name, "month", start_date, end_date, machine_type,
+                                                None, DEFAULT_PAGE_SIZE, DEFAULT_MAX_WORKERS)
+                counts = pd.DataFrame(list(chain.from_iterable(pages)), columns=list(count_columns))
+                counts = counts.rename(columns=count_columns)
+                if not counts.empty:
+                    counts['月份'] = pd.to_datetime(counts['月份'], errors='coerce').dt.to_period('M').astype(str)
+                return counts
+            
+            # 汇总视图随基础表变化, 缓存键以基础表开头, 上传基础表时一并失效
+            return self._cached((table_name, view_name, start_date, end_date, machine_type), fetch)
+        
+        # 模拟模式下的过滤条件
+        if machine_type and '机型_标准化' in counts.columns:
+            counts = counts[counts['机型_标准化'] == machine_type]
+        if start_date:
+            counts = counts[counts['月份'] >= str(pd.Period(start_date, 'M'))]
+        if end_date:
+            counts = counts[counts['月份'] <= str(pd.Period(end_date, 'M'))]
+        return counts.reset_index(drop=True)
+    
+    @staticmethod
+    def _local_counts(df, count_columns):
+        """在本地按汇总视图的口径汇总数据表"""
+        *group_columns, count_column = count_columns.values()
+        if df.empty:
+            return pd.DataFrame(columns=[*group_columns, count_column])
+        
+        date_column = '客诉时间' if count_column == '客诉数' else '出货时间'
+        keys = pd.DataFrame(index=df.index)
+        for col in group_columns:
+            if col == '月份':
+                if date_column in df.columns:
+                    dates = pd.to_datetime(df[date_column], errors='coerce')
+                    keys[col] = dates.dt.to_period('M').astype(str).where(dates.notna())
+                else:
+                    keys[col] = None
+            else:
+                keys[col] = df[col].astype(object) if col in df.columns else None
+        return keys.groupby(group_columns, dropna=False).size().reset_index(name=count_column)
+    
+    def _fetch_table(self, table_name, date_column, start_date, end_date, machine_type, columns,
+                     page_size, max_workers):
+        """分页获取整张表, 所有页的记录最后一次性组装为DataFrame"""
+        if not self.supabase:
             # 模拟模式
-            return st.session_state.get("complaints_data", pd.DataFrame())
+            df = st.session_state.get(f"{table_name}_data", pd.DataFrame())
+            if columns is not None:
+                df = df[[col for col in columns if col in df.columns]]
+            return df
+        
+        def fetch():
+            pages = self._iter_page_records(table_name, date_column, start_date, end_date, machine_type,
+                                            columns, page_size, max_workers)
+            df = pd.DataFrame(list(chain.from_iterable(pages)), columns=columns)
+            if columns is None:
+                # 幂等上传使用的哈希列不属于业务数据
+                df = df.drop(columns=[ROW_KEY_COLUMN, ROW_HASH_COLUMN], errors='ignore')
+            return df
+        
+        key = (table_name, 'rows', start_date, end_date, machine_type, tuple(columns) if columns else None)
+        return self._cached(key, fetch)
     
-    def get_shipment_data(self, start_date=None, end_date=None, machine_type=None):
-        """获取出货数据"""
-        if self.supabase:
-            query = self.supabase.table("shipments").select("*")
-            
-            if start_date:
-                query = query.gte("shipment_date", start_date)
-            if end_date:
-                query = query.lte("shipment_date", end_date)
-            if machine_type:
-                query = query.eq("machine_type_std", machine_type)
-                
-            response = query.execute()
-            return pd.DataFrame(response.data)
+    def _cached(self, key, fetch):
+        """先查结果缓存, 未命中时获取并写入缓存; 返回副本, 调用方修改结果不影响缓存"""
+        cached = self.query_cache.get(key)
+        if cached is None:
+            version = self.query_cache.version(key[0])
+            cached = fetch()
+            self.query_cache.put(key, key[0], version, cached)
+        return cached.copy()
+    
+    def _build_query(self, table_name, date_column, start_date, end_date, machine_type, columns=None,
+                     count=None):
+        """构造带列投影和过滤条件的查询 (每次调用返回新的查询对象)"""
+        select_columns = ",".join(columns) if columns else "*"
+        if count:
+            query = self.supabase.table(table_name).select(select_columns, count=count)
+        else:
+            query = self.supabase.table(table_name).select(select_columns)
+        
+        if start_date:
+            query = query.gte(date_column, start_date)
+        if end_date:
+            query = query.lte(date_column, end_date)
+        if machine_type:
+            query = query.eq("machine_type_std", machine_type)
+        # 分页并发读取依赖各次查询的行顺序一致, 否则页之间可能重叠或遗漏;
+        # 基础表按唯一的row_key排序, 汇总视图按分组列排序
+        if table_name in AGGREGATE_VIEW_COLUMNS:
+            order_columns = list(AGGREGATE_VIEW_COLUMNS[table_name])[:-1]
         else:
+            order_columns = [ROW_KEY_COLUMN]
+        for col in order_columns:
+            query = query.order(col)
+        return query
+    
+    def _iter_page_records(self, table_name, date_column, start_date, end_date, machine_type, columns,
+                           page_size, max_workers):
+        """按行范围分页获取记录
+        
+        第一页同时取回总行数, 其余页并发获取 (最多max_workers个请求同时进行), 按顺序逐页产出。
+        服务端单次返回行数上限小于page_size时, 在该页范围内继续补取, 不会静默截断
+        """
+        if not self.supabase:
             # 模拟模式
-            return st.session_state.get("shipments_data", pd.DataFrame())
+            df = st.session_state.get(f"{table_name}_data", pd.DataFrame())
+            if columns is not None:
+                df = df[[col for col in columns if col in df.columns]]
+            for start in range(0, len(df), page_size):
+                yield df.iloc[start:start + page_size].to_dict('records')
+            return
+        
+        def build_query(count=None):
+            return self._build_query(table_name, date_column, start_date, end_date, machine_type, columns, count)
+        
+        first_response = build_query(count="exact").range(0, page_size - 1).execute()
+        first_page = first_response.data or []
+        total_rows = getattr(first_response, 'count', None)
+        
+        if total_rows is None:
+            # 服务端未返回总行数时顺序翻页, 直到取到空页
+            page = first_page
+            start = 0
+            while page:
+                yield page
+                start += len(page)
+                page = build_query().range(start, start + page_size - 1).execute().data or []
+            return
+        
+        first_page += self._fetch_range(build_query, len(first_page), min(page_size, total_rows))
+        yield first_page
+        
+        page_starts = range(page_size, total_rows, page_size)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pages = executor.map(
+                lambda start: self._fetch_range(build_query, start, min(start + page_size, total_rows)),
+                page_starts
+            )
+            for page in pages:
+                yield page
+    
+    @staticmethod
+    def _fetch_range(build_query, start, end):
+        """获取[start, end)范围内的记录, 单次返回不足时继续补取"""
+        records = []
+        while start + len(records) < end:
+            offset = start + len(records)
+            data = build_query().range(offset, end - 1).execute().data
+            if not data:
+                break
+            records.extend(data)
+        return records
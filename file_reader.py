@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+
+# 四类文件的已知结构: 各列的目标类型, 需要读取的列 (usecols为None时读取全部列),
+# 以及分析时保留的列 (analysis_columns为None时保留全部列; 上传数据库时仍使用完整数据)
+# SN按文本读取, 不会被解析为数字而丢失前导零; 机型为分类类型; 时间列解析为日期
+FILE_SCHEMAS = {
+    'complaints': {
+        'string': ['SN', '问题描述', '解决办法', '客诉ID'],
+        'category': ['机器型号'],
+        'datetime': ['客诉时间'],
+        'usecols': None,
+        'analysis_columns': None,
+    },
+    'shipments': {
+        'string': ['SN'],
+        'category': ['机器型号', '机型_标准化'],
+        'datetime': ['出货时间'],
+        'usecols': None,
+        # 分析时出货数据只用于按机型、时间统计出货台数 (每行一台), 其余列只需上传
+        'analysis_columns': ['SN', '机器型号', '机型_标准化', '出货时间'],
+    },
+    'sn_database_a': {
+        'string': ['SN', '产品描述'],
+        'category': ['机器型号'],
+        'datetime': [],
+        'usecols': None,
+        'analysis_columns': None,
+    },
+    'sn_database_b': {
+        'string': ['SN', '产品描述'],
+        'category': ['机器型号'],
+        'datetime': [],
+        'usecols': None,
+        'analysis_columns': None,
+    },
+}
+
+
+def iter_xlsx_chunks(source, chunksize, usecols=None):
+    """以openpyxl只读模式逐行读取xlsx (不加载整个文档), 每chunksize行产出一个数据表
+
+    usecols不为空时只保留其中存在的列
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(col) if col is not None else f'Unnamed: {i}' for i, col in enumerate(header)]
+        keep = [i for i, col in enumerate(columns) if usecols is None or col in usecols]
+        if len(keep) == len(columns):
+            keep = None
+        else:
+            columns = [columns[i] for i in keep]
+
+        buffer = []
+        for row in rows:
+            buffer.append(row if keep is None else [row[i] if i < len(row) else None for i in keep])
+            if len(buffer) >= chunksize:
+                yield pd.DataFrame(buffer, columns=columns)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=columns)
+    finally:
+        workbook.close()
+
+
+def _read_csv(source, schema):
+    """读取CSV: 有pyarrow时使用其多线程解析器, 文本列直接按字符串解析"""
+    header = list(pd.read_csv(source, nrows=0).columns)
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    usecols = schema['usecols']
+    columns = [col for col in header if usecols is None or col in usecols]
+    text_columns = [col for col in schema['string'] if col in columns]
+
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        return pd.read_csv(source, usecols=columns, dtype={col: str for col in text_columns})
+
+    table = pa_csv.read_csv(
+        source,
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=columns,
+            column_types={col: pa.string() for col in text_columns},
+            # 与pandas一致, 空单元格读为空值
+            strings_can_be_null=True,
+        ),
+    )
+    return table.to_pandas()
+
+
+def _read_excel(source, file_name, schema):
+    """读取Excel: xlsx以只读模式流式读取, 其他格式 (xls) 整体读取"""
+    usecols = schema['usecols']
+    if file_name.endswith('.xlsx'):
+        chunks = list(iter_xlsx_chunks(source, 100000, usecols))
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+    return pd.read_excel(source, usecols=(lambda col: col in usecols) if usecols is not None else None)
+
+
+def _as_text(series):
+    """转为字符串列; Excel中按数字存储的整数 (如12345.0) 转为"12345" """
+    if series.dtype == object:
+        values = series.to_numpy()
+        is_integral_float = np.array(
+            [isinstance(value, float) and value.is_integer() for value in values], dtype=bool
+        )
+        if is_integral_float.any():
+            series = series.copy()
+            series[is_integral_float] = [str(int(value)) for value in values[is_integral_float]]
+    elif pd.api.types.is_float_dtype(series.dtype):
+        integral = series.notna() & (series % 1 == 0)
+        series = series.astype(object).where(~integral, series[integral].astype('int64').astype(str))
+    return series.astype('string')
+
+
+def apply_schema(df, kind):
+    """按文件类型的已知结构设置列类型; 时间列只有全部非空值都能解析时才转换, 避免丢失原始文本"""
+    schema = FILE_SCHEMAS[kind]
+    for col in schema['string']:
+        if col in df.columns:
+            df[col] = _as_text(df[col])
+    for col in schema['category']:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    for col in schema['datetime']:
+        if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            parsed = pd.to_datetime(df[col], errors='coerce')
+            if parsed.notna().sum() == df[col].notna().sum():
+                df[col] = parsed
+    return df
+
+
+def read_data_file(source, file_name, kind):
+    """按文件类型 (FILE_SCHEMAS的键) 读取客诉/出货/SN数据库文件 (CSV或Excel)"""
+    schema = FILE_SCHEMAS[kind]
+    file_name = file_name.lower()
+    if file_name.endswith('.csv'):
+        df = _read_csv(source, schema)
+    else:
+        df = _read_excel(source, file_name, schema)
+    return apply_schema(df, kind)
+
+
+def analysis_columns(df, kind):
+    """返回分析用的数据 (只保留FILE_SCHEMAS中analysis_columns里存在的列), 原数据不变"""
+    columns = FILE_SCHEMAS[kind]['analysis_columns']
+    if columns is None:
+        return df
+    return df[[col for col in df.columns if col in columns]]
@@ -0,0 +1,243 @@
+import sqlite3
+import threading
+import pandas as pd
+
+# 本地库中带索引的过滤列: 列名 → (来源中文列, 是否为日期)
+# 写入时由来源列派生, 与Supabase表中用于过滤的列同名, 查询条件可直接下推到索引
+INDEXED_COLUMNS = {
+    'complaints': {
+        'complain_date': ('客诉时间', True),
+        'machine_type_std': ('机型_标准化', False),
+        'problem_category': ('问题分类', False),
+    },
+    'shipments': {
+        'shipment_date': ('出货时间', True),
+        'machine_type_std': ('机型_标准化', False),
+    },
+}
+
+# 与database.AGGREGATE_VIEWS_SQL口径一致的汇总视图 (SQLite语法)
+LOCAL_VIEWS_SQL = """
+create view if not exists complaint_monthly_counts as
+select date(complain_date, 'start of month') as month,
+       machine_type_std,
+       problem_category,
+       count(*) as complaint_count
+from complaints
+group by 1, 2, 3;
+
+create view if not exists shipment_monthly_counts as
+select date(shipment_date, 'start of month') as month,
+       machine_type_std,
+       count(*) as shipment_count
+from shipments
+group by 1, 2;
+"""
+
+
+def derive_indexed_columns(table_name, frame):
+    """在frame上原地添加由中文来源列派生的过滤列 (INDEXED_COLUMNS), 日期统一为YYYY-MM-DD, 来源列缺失时为空"""
+    for col, (source, is_date) in INDEXED_COLUMNS.get(table_name, {}).items():
+        if source not in frame.columns:
+            frame[col] = None
+        elif is_date:
+            dates = pd.to_datetime(frame[source], errors='coerce')
+            frame[col] = dates.dt.strftime('%Y-%m-%d').where(dates.notna(), None)
+        else:
+            frame[col] = frame[source].where(frame[source].notna(), None)
+    return frame
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class LocalResponse:
+    """与Supabase查询结果相同的接口: data为记录列表, count为总行数"""
+
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class LocalQuery:
+    """Supabase查询构造器的本地实现, 过滤条件和分页转换为SQL执行"""
+
+    def __init__(self, client, table_name):
+        self.client = client
+        self.table_name = table_name
+        self.columns = None
+        self.count = None
+        self.filters = []
+        self.row_range = None
+        self.records = None
+        self.on_conflict = None
+        self.order_columns = []
+
+    def select(self, columns="*", count=None):
+        self.columns = None if columns == "*" else [col.strip() for col in columns.split(",")]
+        self.count = count
+        return self
+
+    def insert(self, records):
+        self.records = records
+        return self
+
+    def upsert(self, records, on_conflict=None):
+        self.records = records
+        self.on_conflict = on_conflict
+        return self
+
+    def gte(self, column, value):
+        self.filters.append((column, '>=', value))
+        return self
+
+    def lte(self, column, value):
+        self.filters.append((column, '<=', value))
+        return self
+
+    def eq(self, column, value):
+        self.filters.append((column, '=', value))
+        return self
+
+    def order(self, column):
+        self.order_columns.append(column)
+        return self
+
+    def range(self, start, end):
+        self.row_range = (start, end)
+        return self
+
+    def execute(self):
+        if self.records is not None:
+            self.client.insert_records(self.table_name, self.records, self.on_conflict)
+            return LocalResponse(self.records)
+        return self.client.select_records(
+            self.table_name, self.columns, self.filters, self.row_range, self.count, self.order_columns
+        )
+
+
+class LocalDatabaseClient:
+    """基于SQLite的本地数据库客户端, 可替代Supabase客户端传入ComplaintDatabase
+
+    数据保存在单个文件中, 重启后仍然存在; 日期和机型列建有索引, 过滤和分页在SQLite中完成,
+    无需网络即可完整运行和测试
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        # 上传和分页读取都可能在多个线程中进行, 共用一个连接并串行执行
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self._table_columns = {}
+        with self.lock:
+            self.connection.execute('pragma journal_mode=wal')
+            for table_name, indexed_columns in INDEXED_COLUMNS.items():
+                self.connection.execute(
+                    f"create table if not exists {table_name} "
+                    f"({', '.join(f'{col} text' for col in indexed_columns)})"
+                )
+                for col in indexed_columns:
+                    self.connection.execute(
+                        f"create index if not exists idx_{table_name}_{col} on {table_name} ({col})"
+                    )
+            self.connection.executescript(LOCAL_VIEWS_SQL)
+            self.connection.commit()
+
+    def table(self, table_name):
+        return LocalQuery(self, table_name)
+
+    def _columns(self, table_name):
+        """表的现有列 (表不存在时为空列表)"""
+        if table_name not in self._table_columns:
+            rows = self.connection.execute(f"pragma table_info({_quote(table_name)})").fetchall()
+            self._table_columns[table_name] = [row[1] for row in rows]
+        return self._table_columns[table_name]
+
+    def _ensure_columns(self, table_name, columns):
+        """按记录的字段建表或补充新列 (各次上传的列可以不同)"""
+        existing = self._columns(table_name)
+        missing = [col for col in columns if col not in existing]
+        if not missing:
+            return
+        if not existing:
+            self.connection.execute(
+                f"create table {_quote(table_name)} ({', '.join(_quote(col) for col in missing)})"
+            )
+        else:
+            for col in missing:
+                self.connection.execute(f"alter table {_quote(table_name)} add column {_quote(col)}")
+        self._table_columns[table_name] = existing + missing
+
+    @staticmethod
+    def _derive_indexed(table_name, records):
+        """由中文来源列派生带索引的过滤列, 日期统一为YYYY-MM-DD"""
+        if table_name not in INDEXED_COLUMNS:
+            return records
+        frame = derive_indexed_columns(table_name, pd.DataFrame.from_records(records))
+        return frame.astype(object).where(frame.notna(), None).to_dict('records')
+
+    def insert_records(self, table_name, records, on_conflict=None):
+        """写入记录; 指定on_conflict (唯一列名) 时, 该列已存在的记录被覆盖"""
+        if not records:
+            return
+        records = self._derive_indexed(table_name, records)
+        columns = list(records[0].keys())
+        placeholders = ', '.join('?' for _ in columns)
+        sql = (f"insert into {_quote(table_name)} ({', '.join(_quote(col) for col in columns)}) "
+               f"values ({placeholders})")
+        with self.lock:
+            self._ensure_columns(table_name, columns)
+            if on_conflict:
+                # 唯一索引允许多个NULL, 不影响建索引前写入的记录
+                self.connection.execute(
+                    f"create unique index if not exists {_quote(f'uq_{table_name}_{on_conflict}')} "
+                    f"on {_quote(table_name)} ({_quote(on_conflict)})"
+                )
+                updates = ', '.join(f"{_quote(col)} = excluded.{_quote(col)}" for col in columns if col != on_conflict)
+                sql += f" on conflict ({_quote(on_conflict)}) do update set {updates}"
+            self.connection.executemany(sql, [tuple(record.get(col) for col in columns) for record in records])
+            self.connection.commit()
+
+    def select_records(self, table_name, columns, filters, row_range, count, order_columns=()):
+        with self.lock:
+            existing = self._columns(table_name)
+            if not existing:
+                # 尚未上传过的表
+                return LocalResponse([], 0 if count else None)
+            if columns is None:
+                # 与上传的数据保持一致, 不返回派生的过滤列
+                hidden = INDEXED_COLUMNS.get(table_name, {})
+                columns = [col for col in existing if col not in hidden]
+            else:
+                columns = [col for col in columns if col in existing]
+
+            where = ' and '.join(f"{_quote(col)} {op} ?" for col, op, _ in filters)
+            where_sql = f" where {where}" if where else ""
+            params = [value for _, _, value in filters]
+
+            total_rows = None
+            if count:
+                total_rows = self.connection.execute(
+                    f"select count(*) from {_quote(table_name)}{where_sql}", params
+                ).fetchone()[0]
+
+            if not columns:
+                return LocalResponse([], total_rows)
+
+            sql = f"select {', '.join(_quote(col) for col in columns)} from {_quote(table_name)}{where_sql}"
+            # 表中尚无的排序列 (如未按幂等方式写入过的row_key) 忽略; 表再按rowid保证顺序唯一
+            order_by = [_quote(col) for col in order_columns if col in existing]
+            is_view = self.connection.execute(
+                "select 1 from sqlite_master where type = 'view' and name = ?", (table_name,)
+            ).fetchone()
+            if not is_view:
+                order_by.append("rowid")
+            if order_by:
+                sql += f" order by {', '.join(order_by)}"
+            if row_range is not None:
+                start, end = row_range
+                sql += f" limit {max(end - start + 1, 0)} offset {start}"
+            rows = self.connection.execute(sql, params).fetchall()
+
+        return LocalResponse([dict(zip(columns, row)) for row in rows], total_rows)
@@ -36,8 +36,8 @@ class ReportGenerator:
         
         return report_summary
     
-    def create_visualizations(self, defect_stats, issue_analysis):
-        """创建可视化图表"""
+    def create_visualizations(self, defect_stats, issue_analysis, defect_trend=None):
+        """创建可视化图表 (defect_trend为calculate_defect_rate_trend的结果, 用于绘制不良率趋势)"""
         figures = {}
         
         # 1. 不良率柱状图
@@ -76,6 +76,19 @@ class ReportGenerator:
             fig3.update_traces(line=dict(width=3))
             figures['defect_trend'] = fig3
         
+        # 4. 滚动不良率趋势图
+        if defect_trend is not None and not defect_trend.empty:
+            fig4 = px.line(
+                defect_trend,
+                x='月份',
+                y='不良率(%)',
+                color='机型_标准化',
+                line_dash='窗口(月)' if defect_trend['窗口(月)'].nunique() > 1 else None,
+                title='不良率趋势',
+                markers=True
+            )
+            figures['defect_rate_trend'] = fig4
+        
         return figures
     
     def export_to_word(self, report_summary, defect_stats, issue_analysis, filename="客诉分析报告.docx"):
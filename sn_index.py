@@ -0,0 +1,183 @@
+import json
+import os
+import uuid
+import numpy as np
+import pandas as pd
+
+
+class MemorySNIndex:
+    """内存SN索引: 以SN为哈希键的数据表 (重复SN保留第一条)"""
+
+    def __init__(self, index_df):
+        self.index_df = index_df
+
+    @property
+    def columns(self):
+        return list(self.index_df.columns)
+
+    def __len__(self):
+        return len(self.index_df)
+
+    def contains(self, sn_keys):
+        """返回每个SN是否存在于索引中 (复用索引自带的哈希表, 不逐次重建)"""
+        return pd.Series(self.index_df.index.get_indexer(sn_keys) >= 0, index=sn_keys.index)
+
+    def lookup(self, sn_keys, columns=None):
+        """按SN取出对应行, 行顺序与sn_keys一致, 未找到的行为空"""
+        index_df = self.index_df if columns is None else self.index_df[columns]
+        return index_df.reindex(sn_keys)
+
+
+class PersistentSNIndex:
+    """磁盘SN索引: 按SN排序的Arrow列式文件 + 定长字节的有序SN键数组
+
+    两个文件都以内存映射方式打开, 打开时不读取数据; 查找时对SN键做二分查找 (O(log n)),
+    再按位置从Arrow表中取出对应行。可在多个会话和进程之间共享
+    """
+
+    def __init__(self, directory, name, meta=None):
+        import pyarrow as pa
+
+        self.directory = directory
+        self.name = name
+        # 元数据指向当前版本的数据文件; 已打开的索引始终使用打开时的版本
+        self.meta = meta if meta is not None else self.read_meta(directory, name)
+        prefix = f"{name}.{self.meta['version']}"
+        self.keys = np.load(self._path(directory, prefix, 'keys.npy'), mmap_mode='r')
+        self.table = pa.ipc.open_file(pa.memory_map(self._path(directory, prefix, 'arrow'), 'r')).read_all()
+
+    # 子进程中重新映射文件, 不序列化数据本身
+    def __getstate__(self):
+        return {'directory': self.directory, 'name': self.name, 'meta': self.meta}
+
+    def __setstate__(self, state):
+        try:
+            self.__init__(state['directory'], state['name'], state['meta'])
+        except FileNotFoundError:
+            # 该版本已被重建替换并删除, 改为打开当前版本
+            self.__init__(state['directory'], state['name'])
+
+    @staticmethod
+    def _path(directory, name, suffix):
+        return os.path.join(directory, f'{name}.{suffix}')
+
+    @classmethod
+    def read_meta(cls, directory, name):
+        """读取索引元数据, 索引不存在时返回None"""
+        meta_path = cls._path(directory, name, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as meta_file:
+            return json.load(meta_file)
+
+    @classmethod
+    def open(cls, directory, name, fingerprint=None):
+        """打开已持久化的索引; 不存在或与给定的数据指纹不一致时返回None"""
+        meta = cls.read_meta(directory, name)
+        if meta is None or 'version' not in meta:
+            return None
+        if fingerprint is not None and meta['fingerprint'] != fingerprint:
+            return None
+        return cls(directory, name, meta)
+
+    @classmethod
+    def build(cls, index_df, directory, name, fingerprint):
+        """将内存SN索引(以SN为索引的数据表)按SN排序后写入磁盘, 返回打开的磁盘索引"""
+        import pyarrow as pa
+
+        # 索引会被各会话直接内存映射, 目录只允许当前用户访问
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        key_bytes = index_df.index.to_series().str.encode('utf-8')
+        width = max(int(key_bytes.str.len().max()), 1) if len(key_bytes) else 1
+        keys = np.asarray(key_bytes.tolist(), dtype=f'S{width}')
+        order = np.argsort(keys, kind='stable')
+
+        sorted_df = index_df.iloc[order].reset_index()
+        # 文本列统一为字符串类型, 避免混合类型的列无法写入Arrow
+        for col in sorted_df.columns:
+            if sorted_df[col].dtype == object:
+                sorted_df[col] = sorted_df[col].astype('string')
+        table = pa.Table.from_pandas(sorted_df, preserve_index=False)
+
+        # 每次构建写入新版本的数据文件, 不覆盖其他会话或进程正在内存映射的旧文件
+        # (截断已映射的文件会使读取方进程崩溃); 数据文件写完后原子替换元数据, 切换到新版本
+        version = uuid.uuid4().hex
+        prefix = f'{name}.{version}'
+        np.save(cls._path(directory, prefix, 'keys.npy'), keys[order])
+        with pa.OSFile(cls._path(directory, prefix, 'arrow'), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+        meta = {'fingerprint': fingerprint, 'rows': len(sorted_df), 'key_width': width, 'version': version}
+        meta_path = cls._path(directory, name, 'meta.json')
+        tmp_path = f'{meta_path}.{version}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(tmp_path, meta_path)
+
+        cls._remove_old_versions(directory, name, version)
+        return cls(directory, name, meta)
+
+    @classmethod
+    def remove(cls, directory, name):
+        """删除持久化的索引 (先删除元数据, 之后打开的会话不再使用它)"""
+        meta_path = cls._path(directory, name, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        if os.path.isdir(directory):
+            cls._remove_old_versions(directory, name, None)
+    
+    @staticmethod
+    def _remove_old_versions(directory, name, version):
+        """删除version以外的数据文件; 仍被映射的文件在POSIX上删除后依然可读, 无法删除时 (如Windows) 保留"""
+        current = {f'{name}.{version}.keys.npy', f'{name}.{version}.arrow'}
+        for file_name in os.listdir(directory):
+            is_data_file = file_name.endswith('.keys.npy') or file_name.endswith('.arrow')
+            if file_name.startswith(f'{name}.') and is_data_file and file_name not in current:
+                try:
+                    os.remove(os.path.join(directory, file_name))
+                except OSError:
+                    pass
+
+    @property
+    def columns(self):
+        return [col for col in self.table.column_names if col != 'SN']
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def positions(self, sn_keys):
+        """二分查找每个SN在有序键数组中的位置, 未找到为-1"""
+        positions = np.full(len(sn_keys), -1, dtype=np.int64)
+        if len(self.keys) == 0:
+            return positions
+
+        width = self.keys.dtype.itemsize
+        key_bytes = sn_keys.str.encode('utf-8')
+        searchable = (key_bytes.notna() & (key_bytes.str.len() <= width)).to_numpy(dtype=bool)
+        if not searchable.any():
+            return positions
+
+        query = np.asarray(key_bytes[searchable].tolist(), dtype=f'S{width}')
+        found = np.searchsorted(self.keys, query)
+        found = np.minimum(found, len(self.keys) - 1)
+        hit = self.keys[found] == query
+
+        searchable_positions = np.flatnonzero(searchable)
+        positions[searchable_positions[hit]] = found[hit]
+        return positions
+
+    def contains(self, sn_keys):
+        """返回每个SN是否存在于索引中"""
+        return pd.Series(self.positions(sn_keys) >= 0, index=sn_keys.index)
+
+    def lookup(self, sn_keys, columns=None):
+        """按SN取出对应行, 行顺序与sn_keys一致, 未找到的行为空"""
+        import pyarrow as pa
+
+        positions = self.positions(sn_keys)
+        table = self.table.select(columns if columns is not None else self.columns)
+        rows = table.take(pa.array(positions, mask=positions < 0)).to_pandas()
+        rows.index = pd.Index(sn_keys, name='SN')
+        return rows